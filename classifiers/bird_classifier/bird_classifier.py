@@ -2,32 +2,52 @@ from torchvision import transforms
 import torch
 from PIL import Image
 
+transform_test = transforms.Compose([
+    transforms.Resize((600, 600), Image.BILINEAR),
+    transforms.CenterCrop((448, 448)),
+    transforms.ToTensor(),
+    transforms.Normalize((0.485, 0.456, 0.406), (0.229, 0.224, 0.225)),
+])
 
-def main(image_path):
-    transform_test = transforms.Compose([
-        transforms.Resize((600, 600), Image.BILINEAR),
-        transforms.CenterCrop((448, 448)),
-        transforms.ToTensor(),
-        transforms.Normalize((0.485, 0.456, 0.406), (0.229, 0.224, 0.225)),
-    ])
 
+def load():
     model = torch.hub.load('nicolalandro/ntsnet-cub200', 'ntsnet', pretrained=True, **{'topN': 6, 'device': 'cpu', 'num_classes': 200})
     model.eval()
+    return model
 
-    img = Image.open(image_path)
-    scaled_img = transform_test(img)
-    torch_images = scaled_img.unsqueeze(0)
 
-    with torch.no_grad():
-        top_n_coordinates, concat_out, raw_logits, concat_logits, part_logits, top_n_index, top_n_prob = model(torch_images)
+def preprocess(image_path):
+    img = Image.open(image_path)
+    return transform_test(img)
 
-        _, predict = torch.max(concat_logits, 1)
-        pred_id = predict.item()
-        bird_class = model.bird_classes[pred_id]
 
+def bird_name(bird_class):
     splitted = bird_class.split('.')
     if len(splitted) != 2:
         return bird_class
 
     return splitted[1].replace('_', ' ')
 
+
+def predict_batch(model, scaled_imgs):
+    torch_images = torch.stack(scaled_imgs)
+
+    with torch.no_grad():
+        top_n_coordinates, concat_out, raw_logits, concat_logits, part_logits, top_n_index, top_n_prob = model(torch_images)
+
+        _, predict = torch.max(concat_logits, 1)
+        bird_classes = [model.bird_classes[pred_id] for pred_id in predict.tolist()]
+
+    return [bird_name(bird_class) for bird_class in bird_classes]
+
+
+def predict(model, image_path):
+    return predict_batch(model, [preprocess(image_path)])[0]
+
+
+def main_batch(image_paths):
+    return predict_batch(load(), [preprocess(image_path) for image_path in image_paths])
+
+
+def main(image_path):
+    return predict(load(), image_path)
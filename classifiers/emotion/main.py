@@ -11,8 +11,14 @@ def load_trained_model(model_path):
     return model
 
 
-def main(image_path):
+def load():
     model = load_trained_model(os.path.join('classifiers', 'emotion', 'FER_trained_model.pt'))
+    face_cascade = cv2.CascadeClassifier(os.path.join('classifiers', 'emotion', 'haarcascade_frontalface_default.xml'))
+    return model, face_cascade
+
+
+def predict(loaded, image_path):
+    model, face_cascade = loaded
 
     emotion_dict = {0: 'neutral', 1: 'happiness', 2: 'surprise', 3: 'sadness',
                     4: 'anger', 5: 'disguest', 6: 'fear'}
@@ -22,7 +28,6 @@ def main(image_path):
     img = cv2.imread(image_path)
     gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
 
-    face_cascade = cv2.CascadeClassifier(os.path.join('classifiers', 'emotion', 'haarcascade_frontalface_default.xml'))
     faces = face_cascade.detectMultiScale(img)
     for (x, y, w, h) in faces:
         cv2.rectangle(img, (x, y), (x + w, y + h), (255, 0, 0), 2)
@@ -42,5 +47,9 @@ def main(image_path):
     return pred
 
 
+def main(image_path):
+    return predict(load(), image_path)
+
+
 if __name__ == "__main__":
     main('/Users/amserra/Documents/GitHub/Maestro/contexts_data/alexandre.serra@tecnico.ulisboa.pt/search-for-donald-trump-images/data/full/baa3b70da76009b49e35b9e89752cd8913fd31c7.jpg')
@@ -57,26 +57,46 @@ def load_model_from_path(path):
     return g_model
 
 
-def pre_process_img(img):
+def preprocess(img):
     x = load_img(img, target_size=(224, 224))
     x = img_to_array(x)
-    x = np.divide(x, 255)
-    return np.expand_dims(x, axis=0)
+    return np.divide(x, 255)
 
 
-def main(image_path):
+def pre_process_img(img):
+    return np.expand_dims(preprocess(img), axis=0)
+
+
+def load():
     weights_path = os.path.join('classifiers', 'flood_depth', 'weights.hdf5')
-    g_model = load_model_from_path(weights_path)
+    return load_model_from_path(weights_path)
+
+
+def predict_batch(g_model, imgs):
+    predictions = g_model.predict(np.stack(imgs), batch_size=len(imgs))
 
-    predictions = g_model.predict(pre_process_img(image_path), batch_size=1)
+    results = []
+    for labels, heights in zip(predictions[0], predictions[1]):
+        label = np.argmax(labels)
+        height = round(heights[0], 4)
+        if label == 0:  # no flood case
+            results.append(None)
+        else:
+            # convert numpy float32 to python float
+            results.append(float(height))
+    return results
 
-    label = np.argmax(predictions[0])
-    height = round(predictions[1][0][0], 4)
-    if label == 0:  # no flood case
-        return None
-    else:
-        # convert numpy float32 to python float
-        return float(height)
+
+def predict(g_model, image_path):
+    return predict_batch(g_model, [preprocess(image_path)])[0]
+
+
+def main_batch(image_paths):
+    return predict_batch(load(), [preprocess(image_path) for image_path in image_paths])
+
+
+def main(image_path):
+    return predict(load(), image_path)
 
 
 # if __name__ == "__main__":
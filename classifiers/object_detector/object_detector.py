@@ -1,17 +1,29 @@
 import torch
 
 
-def main(image_path):
-    # Model
-    model = torch.hub.load('ultralytics/yolov5', 'yolov5s', pretrained=True)
+def load():
+    return torch.hub.load('ultralytics/yolov5', 'yolov5s', pretrained=True)
+
+
+def predict_batch(model, image_paths):
+    # Inference on the whole batch of images
+    results = model(image_paths)
+    labels = []
+    for detections in results.pandas().xyxy:
+        try:
+            labels.append(detections['name'].values.tolist())
+        except:
+            labels.append(None)
+    return labels
+
 
-    # Images
-    imgs = [image_path]  # batch of images
+def predict(model, image_path):
+    return predict_batch(model, [image_path])[0]
 
-    # Inference
-    results = model(imgs)
-    try:
-        return results.pandas().xyxy[0]['name'].values.tolist()
-    except:
-        return None
 
+def main_batch(image_paths):
+    return predict_batch(load(), image_paths)
+
+
+def main(image_path):
+    return predict(load(), image_path)
@@ -3,22 +3,39 @@ import zipfile
 import torchaudio
 from glob import glob
 
+device = torch.device('cpu')  # gpu also works, but our models are fast enough for CPU
+
+
+def load():
+    return torch.hub.load(repo_or_dir='snakers4/silero-models',
+                          model='silero_stt',
+                          language='en',  # also available 'de', 'es'
+                          device=device)
 
-def main(sound_path):
-    device = torch.device('cpu')  # gpu also works, but our models are fast enough for CPU
 
-    model, decoder, utils = torch.hub.load(repo_or_dir='snakers4/silero-models',
-                                           model='silero_stt',
-                                           language='en',  # also available 'de', 'es'
-                                           device=device)
+def predict_batch(loaded, sound_paths):
+    model, decoder, utils = loaded
     (read_batch, split_into_batches,
      read_audio, prepare_model_input) = utils  # see function signature for details
 
-    test_files = [sound_path]
-    batches = split_into_batches(test_files, batch_size=10)
+    batches = split_into_batches(sound_paths, batch_size=len(sound_paths))
     model_input = prepare_model_input(read_batch(batches[0]), device=device)
 
     output = model(model_input)
+    results = []
     for example in output:
         result = decoder(example.cpu())
-        return result if result is not None and result != '' else None
+        results.append(result if result is not None and result != '' else None)
+    return results
+
+
+def predict(loaded, sound_path):
+    return predict_batch(loaded, [sound_path])[0]
+
+
+def main_batch(sound_paths):
+    return predict_batch(load(), sound_paths)
+
+
+def main(sound_path):
+    return predict(load(), sound_path)
@@ -1,5 +1,6 @@
 from django.contrib import admin
-from context.models import Fetcher, PostProcessor, Filter, Classifier
+from context.models import Fetcher, PostProcessor, Filter, Classifier, ClassificationResult, ProviderBatch
+from context.tasks.provide import replay_batches
 
 
 @admin.register(Fetcher)
@@ -20,3 +21,21 @@ class Filters(admin.ModelAdmin):
 @admin.register(Classifier)
 class Classifiers(admin.ModelAdmin):
     pass
+
+
+@admin.register(ClassificationResult)
+class ClassificationResults(admin.ModelAdmin):
+    list_display = ('classifier', 'model_version', 'context', 'object_id', 'result')
+    list_filter = ('classifier',)
+
+
+@admin.register(ProviderBatch)
+class ProviderBatches(admin.ModelAdmin):
+    list_display = ('context', 'number', 'total', 'status', 'attempts', 'last_status', 'last_error', 'next_retry_at', 'delivered_at')
+    list_filter = ('status',)
+    actions = ['replay']
+
+    @admin.action(description='Replay the selected batches')
+    def replay(self, request, queryset):
+        replayed = replay_batches(queryset)
+        self.message_user(request, f'{replayed} batches will be delivered again')
@@ -0,0 +1,138 @@
+"""
+Exports of the context data that are streamed to the browser, so the memory used by a download doesn't depend on the size of the context.
+"""
+import csv
+import json
+import os
+from itertools import islice
+from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED, ZIP_STORED
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from context.tasks.provide import classification_results, result_entries
+
+CHUNK_SIZE = 64 * 1024
+JSON = 'json'
+NDJSON = 'ndjson'
+CSV = 'csv'
+RESULTS_FORMATS = {
+    JSON: ('application/json', 'results.json'),
+    NDJSON: ('application/x-ndjson', 'results.ndjson'),
+    CSV: ('text/csv', 'results.csv'),
+}
+CSV_COLUMNS = ['classifier', 'name', 'preview_url', 'result', 'datetime']
+# Formats that are already compressed. Compressing them again takes CPU time without reducing their size
+COMPRESSED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.mp3', '.ogg', '.flac', '.m4a', '.aac', '.zip', '.gz'}
+
+
+class StreamBuffer:
+    """Unseekable file object collecting what the zip writer writes, until it is taken by the response"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def compress_type(path):
+    return ZIP_STORED if os.path.splitext(path)[1].lower() in COMPRESSED_EXTENSIONS else ZIP_DEFLATED
+
+
+def stream_zip(paths):
+    """Yields a zip archive with the files in paths (named by their base name), in chunks. Files that can't be read are skipped"""
+    return (chunk for chunk in _zip_chunks(paths) if chunk)
+
+
+def _zip_chunks(paths):
+    buffer = StreamBuffer()
+    with ZipFile(buffer, 'w') as zip_file:
+        for path in paths:
+            try:
+                info = ZipInfo.from_file(path, os.path.basename(path))
+                source = open(path, 'rb')
+            except OSError as ex:
+                print(ex)
+                continue
+            info.compress_type = compress_type(path)
+            with source, zip_file.open(info, 'w') as dest:
+                while True:
+                    chunk = source.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    dest.write(chunk)
+                    yield buffer.take()
+            yield buffer.take()
+    yield buffer.take()  # central directory
+
+
+def object_batches(datastream):
+    """Yields the objects of the datastream in lists of settings.EXPORT_CHUNK_SIZE, loading only the columns used in the results"""
+    objects = datastream.order_by('id').for_results().iterator(chunk_size=settings.EXPORT_CHUNK_SIZE)
+    while True:
+        batch = list(islice(objects, settings.EXPORT_CHUNK_SIZE))
+        if not batch:
+            return
+        yield batch
+
+
+def result_batches(classifiers, datastream, keep_null=True):
+    """Yields the (classifier name, entry) pairs of each batch of objects, with their results fetched with one query per batch"""
+    for batch in object_batches(datastream):
+        results = classification_results(classifiers, datastream.filter(id__in=[data.id for data in batch]))
+        yield list(result_entries(classifiers, batch, results, keep_null))
+
+
+def indent(text, spaces):
+    return '\n'.join(' ' * spaces + line for line in text.split('\n'))
+
+
+def _json_chunks(classifiers, datastream, keep_null):
+    # Same document as json.dumps(generate_json(...), indent=4), written one classifier (and one batch of objects) at a time
+    yield '{'
+    for classifier_index, classifier in enumerate(classifiers):
+        yield f'{"," if classifier_index > 0 else ""}\n    {json.dumps(classifier.name)}: ['
+        first = True
+        for entries in result_batches([classifier], datastream, keep_null):
+            if entries:
+                yield ('' if first else ',') + ','.join(f'\n{indent(json.dumps(entry, indent=4, cls=DjangoJSONEncoder), 8)}' for _, entry in entries)
+                first = False
+        yield ']' if first else '\n    ]'
+    yield '\n}' if classifiers else '}'
+
+
+def _ndjson_chunks(classifiers, datastream, keep_null):
+    for entries in result_batches(classifiers, datastream, keep_null):
+        yield ''.join(json.dumps({'classifier': classifier_name, **entry}, cls=DjangoJSONEncoder) + '\n' for classifier_name, entry in entries)
+
+
+class _Lines:
+    def write(self, line):
+        return line
+
+
+def _csv_chunks(classifiers, datastream, keep_null):
+    writer = csv.writer(_Lines())
+    yield writer.writerow(CSV_COLUMNS)
+    for entries in result_batches(classifiers, datastream, keep_null):
+        yield ''.join(writer.writerow([
+            classifier_name,
+            entry['name'],
+            entry['preview_url'],
+            entry['result'] if isinstance(entry['result'], str) or entry['result'] is None else json.dumps(entry['result'], cls=DjangoJSONEncoder),
+            entry['datetime']
+        ]) for classifier_name, entry in entries)
+
+
+def stream_results(classifiers, datastream, results_format=JSON, keep_null=True):
+    """Yields the results of the classifiers on the datastream in the given format (json, ndjson or csv), encoded in UTF-8"""
+    chunks = {JSON: _json_chunks, NDJSON: _ndjson_chunks, CSV: _csv_chunks}[results_format]
+    return (chunk.encode('utf-8') for chunk in chunks(list(classifiers), datastream, keep_null) if chunk)
@@ -113,7 +113,7 @@ class FetchingAndGatheringConfigurationForm(forms.ModelForm):
 
     class Meta:
         model = AdvancedConfiguration
-        fields = ['initial_datastream', 'country_of_search', 'seed_urls', 'fetchers', 'yield_after_gathering_data']
+        fields = ['initial_datastream', 'country_of_search', 'seed_urls', 'fetchers', 'max_urls', 'yield_after_gathering_data']
 
 
 class PostProcessingConfigurationForm(forms.ModelForm):
@@ -215,4 +215,4 @@ class ClassificationConfigurationForm(forms.ModelForm):
 class ProvidingConfigurationForm(forms.ModelForm):
     class Meta:
         model = AdvancedConfiguration
-        fields = ['webhook', 'minimum_objects', 'keep_null', 'notify_creator']
+        fields = ['webhook', 'webhook_format', 'minimum_objects', 'keep_null', 'notify_creator']
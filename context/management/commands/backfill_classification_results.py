@@ -0,0 +1,65 @@
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from context.models import ImageData, SoundData, Classifier, ClassificationResult
+
+# Model version of the copied results. The version that produced them is unknown, so the classifiers classify the objects again in the next iteration
+LEGACY_MODEL_VERSION = 'legacy'
+
+
+def legacy_results(obj, classifiers):
+    """ClassificationResults with the results in the classification_result column of obj, or None if one of its classifiers doesn't exist"""
+    results = []
+    for name, result in obj.classification_result.items():
+        classifier = classifiers.get(name, None)
+        if classifier is None:
+            return None
+        results.append(ClassificationResult(
+            content_type=ContentType.objects.get_for_model(obj),
+            object_id=obj.id,
+            context_id=obj.context_id,
+            classifier=classifier,
+            model_version=LEGACY_MODEL_VERSION,
+            result=result
+        ))
+    return results
+
+
+class Command(BaseCommand):
+    help = 'Copies the classification results stored in the classification_result column of the data objects to the ClassificationResult table'
+
+    def handle(self, *args, **options):
+        classifiers = {}
+        for classifier in Classifier.objects.order_by('-id'):
+            classifiers[classifier.name] = classifier  # the oldest classifier of each name
+
+        for model in (ImageData, SoundData):
+            copied = 0
+            skipped = 0
+            last_id = 0
+            pending = model.objects.filter(classification_result__isnull=False).order_by('id').only('id', 'context_id', 'classification_result')
+            while True:
+                batch = list(pending.filter(id__gt=last_id)[:settings.RESULTS_COMMIT_INTERVAL])
+                if not batch:
+                    break
+                last_id = batch[-1].id
+
+                results = []
+                copied_objects = []
+                for obj in batch:
+                    obj_results = legacy_results(obj, classifiers) if isinstance(obj.classification_result, dict) else None
+                    if obj_results is None:
+                        skipped += 1
+                        self.stderr.write(f'{model.__name__} {obj.id}: results {obj.classification_result} not copied (unknown classifier)')
+                        continue
+                    results += obj_results
+                    obj.classification_result = None
+                    copied_objects.append(obj)
+
+                # The column is cleared in the same transaction, so running the command again only copies what is left
+                with transaction.atomic():
+                    ClassificationResult.objects.bulk_create(results, ignore_conflicts=True)
+                    model.objects.bulk_update(copied_objects, ['classification_result'])
+                copied += len(copied_objects)
+            self.stdout.write(f'{model.__name__}: results of {copied} objects copied, {skipped} skipped')
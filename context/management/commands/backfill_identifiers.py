@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from context.models import ImageData, SoundData
+from context.tasks.helpers import BulkUpdater
+
+
+class Command(BaseCommand):
+    help = 'Sets the identifier of the data objects created before it was stored in the database'
+
+    def handle(self, *args, **options):
+        for model in (ImageData, SoundData):
+            updated = 0
+            with BulkUpdater(model, ['identifier']) as updater:
+                for obj in model.objects.filter(identifier='').only('id', 'data').iterator():
+                    obj.refresh_identifier()
+                    updater.add(obj)
+                    updated += 1
+            self.stdout.write(f'{model.__name__}: {updated} identifiers set')
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+from context.models import SearchContext
+from context.tasks.fanout import id_ranges
+
+
+class Command(BaseCommand):
+    help = 'Prints the query plans of the data object queries run by the stages and pages of a search context. Run it before and after migrating to compare the plans'
+
+    def add_arguments(self, parser):
+        parser.add_argument('code', help='Code of the search context')
+        parser.add_argument('--analyze', action='store_true', help='Runs the queries, showing their actual time (EXPLAIN ANALYZE)')
+
+    def handle(self, *args, **options):
+        context = SearchContext.objects.filter(code=options['code']).first()
+        if context is None:
+            raise CommandError(f'Search context {options["code"]} does not exist')
+        datastream = context.datastream
+        if datastream is None:
+            raise CommandError(f'Search context {options["code"]} is not configured')
+
+        unfiltered = datastream.unfiltered()
+        first = datastream.order_by('id').first()
+        if first is None:
+            raise CommandError(f'Search context {options["code"]} has no data objects')
+        ranges = id_ranges(unfiltered)
+        queries = {
+            'Unfiltered objects ids (stage fan-out)': unfiltered.ids(),
+            'Objects of an id range (stage chunk)': unfiltered.in_id_range(*ranges[0]) if ranges else None,
+            'Object by identifier (object page)': datastream.filter(identifier=first.identifier),
+            'Object by data path (data review)': datastream.filter(data=first.data),
+            'Results page': datastream.order_by('add_date', 'id')[:15],
+        }
+        for title, queryset in queries.items():
+            self.stdout.write(self.style.MIGRATE_HEADING(title))
+            if queryset is None:
+                self.stdout.write('Skipped: every data object was filtered')
+            else:
+                self.stdout.write(queryset.explain(analyze=options['analyze']))
+            self.stdout.write('')
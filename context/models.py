@@ -2,10 +2,12 @@ import os
 from django.conf import settings
 from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
-from django.contrib.contenttypes.fields import GenericForeignKey
+from django.utils.functional import cached_property
+from django.contrib.contenttypes.fields import GenericForeignKey, GenericRelation
 from django.contrib.contenttypes.models import ContentType
 from taggit.managers import TaggableManager
 from django.contrib.postgres.fields import ArrayField
+from context.publishing import publish, published_url
 
 # Hardcoded for now
 THUMB_SIZE = (270, 270)
@@ -33,10 +35,21 @@ def validate_file_extension(value):
 class AdvancedConfiguration(models.Model):
     DEFAULT_COUNTRY_OF_SEARCH = 'PT'
 
+    # Webhook formats (see context/tasks/provide.py)
+    JSON = 'JSON'
+    JSON_BATCHES = 'JSON BATCHES'
+    NDJSON_BATCHES = 'NDJSON BATCHES'
+    WEBHOOK_FORMATS = [
+        (JSON, 'JSON (all the results in one request)'),
+        (JSON_BATCHES, 'JSON batches (gzip compressed)'),
+        (NDJSON_BATCHES, 'NDJSON batches (gzip compressed)'),
+    ]
+
     initial_datastream = models.FileField(upload_to='initial_datastreams/', help_text='Only zips are accepted.', validators=[validate_file_extension], blank=True, null=True)
     country_of_search = models.CharField(max_length=2, choices=COUNTRY_CHOICES, default=DEFAULT_COUNTRY_OF_SEARCH, null=True, blank=True)
     # freshness/date = ...
     seed_urls = ArrayField(models.URLField(), null=True)
+    max_urls = models.IntegerField(verbose_name='Maximum number of URLs', null=True, blank=True, help_text='Maximum number of URLs the fetchers can retrieve in each iteration. If empty, a default limit is used.')
     fetchers = models.ManyToManyField(to='Fetcher', blank=True)
     post_processors = models.ManyToManyField(to='PostProcessor', blank=True)
     filters = models.ManyToManyField(to='Filter', blank=True)
@@ -54,6 +67,7 @@ class AdvancedConfiguration(models.Model):
 
     # Providing
     webhook = models.URLField(null=True, blank=True, help_text='HTTP REST endpoint to which data will be sent in JSON format as a POST request.')
+    webhook_format = models.CharField(max_length=20, choices=WEBHOOK_FORMATS, default=JSON, help_text='Batches are sent in several requests, each with an Idempotency-Key header. Recommended for large search contexts.')
     minimum_objects = models.IntegerField(verbose_name='Minimum number of data objects', default=1, blank=True, null=True, help_text='Minimum number of data objects required in order for data to be sent to the receiver through the webhook.')
     keep_null = models.BooleanField(verbose_name='Send objects that weren\'t classified', default=True, help_text='Whether to send the result of data objects that the classifier was unable to classify.')
     notify_creator = models.BooleanField(default=True, help_text='Whether to notify the search context\'s creator (by email) at the end of a successful execution.')
@@ -186,6 +200,7 @@ class SearchContext(models.Model):
     status = models.CharField(max_length=30, choices=STATUS_CHOICES)
     is_stopped = models.BooleanField(default=True)
     number_of_iterations = models.IntegerField(default=0)
+    next_run_at = models.DateTimeField(null=True, blank=True, db_index=True)  # when the next iteration of a repeated context is due (see tasks/schedule.py)
 
     # Owner of search context (can be User or Organization)
     owner_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
@@ -210,32 +225,53 @@ class SearchContext(models.Model):
     def context_folder_static(self):
         return os.path.join(settings.STATIC_ROOT, self.owner_code, self.code)
 
+    def publish_file(self, source):
+        """Publishes a context file in the static folder, with the configured strategy. Returns the published path"""
+        return publish(source, self.context_folder_static)
+
+    @cached_property
+    def data_model(self):
+        """Model of the data objects, given by the configured data type (None if the context isn't configured)"""
+        if self.configuration is None:
+            return None
+        return DATA_MODELS.get(self.configuration.data_type, None)
+
     @property
     def datastream(self):
-        if self.imagedata_set.exists():
-            return self.imagedata_set.all()
-        elif self.sounddata_set.exists():
-            return self.sounddata_set.all()
-        # Other datatype cases
-        else:
+        """
+        Data objects of the context. No query is made to find their type, and the model is cached in the instance (e.g.: for the duration of a task).
+        A new queryset is returned on each access, so counts and iterations always read the current objects
+        """
+        if self.data_model is None:
             return None
+        return self.data_model.objects.filter(context=self)
 
     def __str__(self):
         return self.code
 
 
 def api_logs_path():
+    # Referenced by the migrations of the file based cache, which stored the results in this folder
     return os.path.join(settings.LOGS_PATH, 'apis')
 
 
-class APIResults(models.Model):
+class FetchCache(models.Model):
     """
-        Caches API request queries. This prevents duplicate requests. Used only in a dev (settings.DEBUG=True) environment
-        Not applicable to non-dev environments because they may require time-sensitive data
+        Caches the URLs fetched for a query, so that contexts repeating the same query (e.g.: in every iteration) don't make a new API request while the result is fresh.
+        Queries are identified by a hash of the normalized fetcher parameters. Each fetcher defines for how long its results are fresh (cache_ttl).
+        Replaces the APIResults model of the file based cache, whose rows are discarded when migrating.
     """
-    configuration = models.JSONField(encoder=DjangoJSONEncoder)
+    key = models.CharField(max_length=64)  # sha256 of the normalized fetcher parameters
     fetcher = models.ForeignKey(to='Fetcher', on_delete=models.CASCADE)
-    result_file = models.FilePathField(path=api_logs_path)
+    urls = models.JSONField(default=list)
+    size = models.IntegerField(default=0)  # number of URLs, used to bound the size of the cache
+    update_date = models.DateTimeField(auto_now=True)
+    expire_date = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['fetcher', 'key'], name='unique_fetcher_query')
+        ]
 
     def __str__(self):
         return f'API results for fetcher {self.fetcher}'
@@ -262,6 +298,8 @@ class Fetcher(models.Model):
     is_default = models.BooleanField(default=False, help_text='Tells if this fetcher is used by default (when a context doesn\'t have fetchers specified). A default fetcher is only used if it is active.')
     type = models.CharField(max_length=20, choices=FETCHER_TYPE)
     path = models.FilePathField(path=fetchers_path, recursive=True, match='fetcher_*')
+    timeout = models.IntegerField(default=60, help_text='Maximum number of seconds the fetcher can take. If it takes longer, its results are ignored.')
+    cache_ttl = models.IntegerField(default=3600, help_text='Number of seconds during which the URLs fetched for a query are reused by contexts making the same query. 0 disables caching.')
     # TODO: Ideally there's another field here: supported datatypes. Some fetchers (e.g.: bing image) don't make sense fetching some data types (e.g.: sounds). Since we are only supporting image data type for now, we can leave it like this
 
     def __str__(self):
@@ -352,6 +390,107 @@ class Classifier(models.Model):
         return self.name
 
 
+class ClassificationResult(models.Model):
+    """Result of a classifier (in a given model version) on a data object"""
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    data = GenericForeignKey('content_type', 'object_id')
+    context = models.ForeignKey(to=SearchContext, on_delete=models.CASCADE)
+    classifier = models.ForeignKey(to=Classifier, on_delete=models.CASCADE)
+    model_version = models.CharField(max_length=64)
+    result = models.JSONField(encoder=DjangoJSONEncoder, null=True)
+    add_date = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['content_type', 'object_id', 'classifier', 'model_version'], name='unique_classification_result')
+        ]
+        indexes = [
+            models.Index(fields=['context', 'classifier'])
+        ]
+
+    def __str__(self):
+        return f'{self.classifier} ({self.model_version}) result of object {self.object_id}: {self.result}'
+
+
+class ProviderBatch(models.Model):
+    """A batch of results sent to the webhook of a context (see context/tasks/provide.py). Batches that keep failing are kept as dead letters, which can be replayed"""
+    PENDING = 'PENDING'
+    RETRYING = 'RETRYING'
+    DELIVERED = 'DELIVERED'
+    DEAD = 'DEAD'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RETRYING, 'Retrying'),
+        (DELIVERED, 'Delivered'),
+        (DEAD, 'Dead (failed every retry)'),
+    ]
+
+    context = models.ForeignKey(to=SearchContext, on_delete=models.CASCADE)
+    key = models.CharField(max_length=64)  # sent in the Idempotency-Key header
+    number = models.IntegerField()
+    total = models.IntegerField()
+    webhook_format = models.CharField(max_length=20, choices=AdvancedConfiguration.WEBHOOK_FORMATS)
+    object_ids = ArrayField(models.IntegerField())
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    last_status = models.IntegerField(null=True, blank=True)  # HTTP status of the last attempt (None if there was no response)
+    last_error = models.TextField(blank=True)
+    next_retry_at = models.DateTimeField(null=True, blank=True)
+    create_date = models.DateTimeField(auto_now_add=True)
+    delivered_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['context', 'status'])
+        ]
+
+    def __str__(self):
+        return f'Batch {self.number}/{self.total} of context {self.context}'
+
+
+class DataQuerySet(models.QuerySet):
+    """Queries shared by every data type, so stages don't depend on the model of the datastream"""
+
+    def unfiltered(self):
+        """Objects that reach the classification and providing stages"""
+        return self.filter(filtered=False)
+
+    def in_id_range(self, first_id, last_id):
+        return self.filter(id__range=(first_id, last_id))
+
+    def ids(self):
+        return self.order_by('id').values_list('id', flat=True)
+
+    def for_results(self):
+        """Loads only the columns used in the results (sent to the webhook or downloaded)"""
+        return self.only('id', 'identifier', 'metadata', self.model.static_field)
+
+    def with_classification_results(self):
+        """Prefetches the classification results (and their classifiers), so classifications doesn't query the database for each object"""
+        return self.prefetch_related(models.Prefetch(
+            'classification_results',
+            queryset=ClassificationResult.objects.select_related('classifier').order_by('id')
+        ))
+
+    def not_seen_by(self, stage, plugin, version):
+        """Objects that weren't processed by the plugin (post-processor or filter) in version yet (see Data.stage_watermarks)"""
+        return self.exclude(stage_watermarks__contains={watermark_key(stage, plugin): version})
+
+    def not_provided(self):
+        """Objects never sent to the webhook, or with classification results added after they were sent"""
+        newer_results = ClassificationResult.objects.filter(
+            content_type=ContentType.objects.get_for_model(self.model),
+            object_id=models.OuterRef('pk'),
+            add_date__gt=models.OuterRef('provided_at')
+        )
+        return self.filter(models.Q(provided_at__isnull=True) | models.Exists(newer_results))
+
+
+def watermark_key(stage, plugin):
+    return f'{stage}:{plugin.id}'
+
+
 # Data objects
 class Data(models.Model):
     metadata = models.JSONField(encoder=DjangoJSONEncoder, null=True)
@@ -359,25 +498,58 @@ class Data(models.Model):
     context = models.ForeignKey(to=SearchContext, on_delete=models.CASCADE)
     add_date = models.DateTimeField(auto_now_add=True)
     filtered = models.BooleanField(default=False)  # tells if the data object was filtered by a filter, so it is not considered in the next stages
+    identifier = models.CharField(max_length=200, blank=True)  # base name of the data file, used in the URLs of the object. Set by refresh_identifier
+    classification_results = GenericRelation(ClassificationResult)
+    # Results stored before the ClassificationResult table (by classifier name). Copied to the table by the backfill_classification_results command
     classification_result = models.JSONField(encoder=DjangoJSONEncoder, null=True)
+    # Version of each post-processor and filter that processed the object, by '<stage>:<plugin id>'. Repeated iterations only process what changed
+    stage_watermarks = models.JSONField(default=dict)
+    provided_at = models.DateTimeField(null=True, blank=True)  # when the object was last sent to the webhook
+
+    objects = DataQuerySet.as_manager()
 
     class Meta:
         abstract = True
+        constraints = [
+            models.UniqueConstraint(fields=['context', 'data'], name='unique_%(class)s_per_context')
+        ]
+        # Stages read the objects of a context (mostly the unfiltered ones, in id ranges), and the results pages sort them by date.
+        # The unique constraint also indexes the lookups by data path
+        indexes = [
+            models.Index(fields=['context', 'identifier'], name='%(app_label)s_%(class)s_identifier'),
+            models.Index(fields=['context', 'filtered'], name='%(app_label)s_%(class)s_filtered'),
+            models.Index(fields=['context', 'add_date'], name='%(app_label)s_%(class)s_add_date'),
+            models.Index(fields=['context', 'id'], condition=models.Q(filtered=False), name='%(app_label)s_%(class)s_unfiltered'),
+        ]
+
+    @property
+    def classifications(self):
+        """Latest result of each classifier, by classifier name (None if the object wasn't classified)"""
+        results = {}
+        for result in sorted(self.classification_results.all(), key=lambda result: result.id):
+            results[result.classifier.name] = result.result
+        return results or None
+
+    def refresh_identifier(self):
+        self.identifier = os.path.basename(self.data)
+
+    def save(self, *args, **kwargs):
+        self.refresh_identifier()
+        super().save(*args, **kwargs)
+
+    def mark_seen(self, stage, plugin, version):
+        self.stage_watermarks = {**(self.stage_watermarks or {}), watermark_key(stage, plugin): version}
 
 
 class SoundData(Data):
     data = models.FilePathField(max_length=200)
     data_static = models.FilePathField(max_length=200)
 
-    @property
-    def identifier(self):
-        return os.path.basename(self.data)
+    static_field = 'data_static'  # published file (see thumb_url)
 
     @property
     def thumb_url(self):
-        rel_path = os.path.relpath(self.data_static, settings.BASE_DIR)
-        rel_path = rel_path.replace('data/', '')
-        return f'{settings.DOMAIN}/{rel_path}'
+        return f'{settings.DOMAIN}{published_url(self.data_static)}'
 
     def __str__(self):
         return f'Sound data of context {self.context.code}: {os.path.basename(self.data)}'
@@ -388,21 +560,22 @@ class ImageData(Data):
     data_thumb = models.FilePathField(max_length=200)
     data_thumb_static = models.FilePathField(max_length=200)
 
-    @property
-    def identifier(self):
-        return os.path.basename(self.data)
+    static_field = 'data_thumb_static'  # published file (see thumb_url)
 
     @property
     def thumb_url(self):
-        rel_path = os.path.relpath(self.data_thumb_static, settings.BASE_DIR)
-        rel_path = rel_path.replace('data/thumbs/', '')
-        return f'{settings.DOMAIN}/{rel_path}'
+        return f'{settings.DOMAIN}{published_url(self.data_thumb_static)}'
 
     @property
     def thumb_url_base(self):  # thumb_url without the domain (use in templates)
-        rel_path = os.path.relpath(self.data_thumb_static, settings.BASE_DIR)
-        rel_path = rel_path.replace('data/thumbs/', '')
-        return f'/{rel_path}'
+        return published_url(self.data_thumb_static)
 
     def __str__(self):
         return f'Image data of context {self.context.code}: {os.path.basename(self.data)}'
+
+
+# Model of the data objects of each data type (see SearchContext.datastream)
+DATA_MODELS = {
+    Configuration.IMAGES: ImageData,
+    Configuration.SOUNDS: SoundData,
+}
@@ -0,0 +1,59 @@
+"""
+Publishing of the context files (image thumbnails and sounds) that are served to the browser and to the provider receivers.
+The strategy is chosen with settings.STATIC_PUBLISH_STRATEGY:
+- copy: the file is copied into the context static folder
+- hardlink: the file is hard linked into the context static folder (falls back to copying if the folders are on different file systems)
+- symlink: a symbolic link to the file is created in the context static folder
+- internal: nothing is written. The file is served by the published file view, through the web server (X-Accel-Redirect/X-Sendfile) if configured
+In every case, the published path (inside the context static folder) is the one stored in the data objects.
+"""
+import os
+import shutil
+from django.conf import settings
+from django.urls import reverse
+
+COPY = 'copy'
+HARDLINK = 'hardlink'
+SYMLINK = 'symlink'
+INTERNAL = 'internal'
+
+STRATEGIES = (COPY, HARDLINK, SYMLINK, INTERNAL)
+
+
+def publish(source, dest_folder, strategy=None):
+    """Publishes source into dest_folder. Returns the published path"""
+    strategy = strategy or settings.STATIC_PUBLISH_STRATEGY
+    dest = os.path.join(dest_folder, os.path.basename(source))
+    if strategy == INTERNAL:
+        return dest
+
+    if os.path.lexists(dest):
+        os.remove(dest)
+
+    if strategy == HARDLINK:
+        try:
+            os.link(source, dest)
+            return dest
+        except OSError:
+            pass
+    elif strategy == SYMLINK:
+        os.symlink(os.path.abspath(source), dest)
+        return dest
+
+    return shutil.copy2(source, dest)
+
+
+def unpublish(published_path):
+    """Removes a published file. Files published internally don't exist, so missing files are ignored"""
+    try:
+        os.remove(published_path)
+    except FileNotFoundError:
+        pass
+
+
+def published_url(published_path):
+    """URL (without the domain) of a published file"""
+    rel_path = os.path.relpath(published_path, settings.STATIC_ROOT)
+    if settings.STATIC_PUBLISH_STRATEGY == INTERNAL:
+        return reverse('contexts-published-file', args=[rel_path])
+    return f'{settings.STATIC_URL}{rel_path}'
@@ -7,6 +7,7 @@ from .filter import run_filters
 from .classify import run_classifiers
 from .provide import run_provider
 from .handle_initial_datastream import handle_initial_datastream
+from .schedule import schedule_iterations
 
 __all__ = [
     'create_context_folder',
@@ -18,4 +19,5 @@ __all__ = [
     'run_classifiers',
     'run_provider',
     'handle_initial_datastream',
+    'schedule_iterations',
 ]
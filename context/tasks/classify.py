@@ -1,10 +1,73 @@
-import importlib.util
-from context.models import SearchContext
-from context.tasks.helpers import change_status, write_log
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Exists, OuterRef
+from context.models import SearchContext, ClassificationResult
+from context.tasks.executor import load_plugin, run_plugin, timed
+from context.tasks.fanout import id_ranges, run_stage
+from context.tasks.helpers import buffered_log, change_status, write_log, prefetched_batches, BulkCreator
+from context.tasks.model_registry import get_predictor, get_batch_predictor, plugin_version
 from maestro.celery import app
 
 
+def unclassified(datastream, classifier, model_version):
+    """Objects of the datastream without a result of the classifier in model_version (anti-join with the results table)"""
+    results = ClassificationResult.objects.filter(
+        content_type=ContentType.objects.get_for_model(datastream.model),
+        object_id=OuterRef('pk'),
+        classifier=classifier,
+        model_version=model_version
+    )
+    return datastream.filter(~Exists(results))
+
+
+class ResultsWriter(BulkCreator):
+    """Creates the classification results of a classifier in bulk"""
+
+    def __init__(self, context, classifier, model_version, data_model):
+        super().__init__(ClassificationResult)
+        self.context = context
+        self.classifier = classifier
+        self.model_version = model_version
+        self.content_type = ContentType.objects.get_for_model(data_model)
+
+    def add_result(self, data, result):
+        self.add(ClassificationResult(
+            content_type=self.content_type,
+            object_id=data.pk,
+            context=self.context,
+            classifier=self.classifier,
+            model_version=self.model_version,
+            result=result
+        ))
+
+
+def classify_chunk(classifier_script, file_paths, classifier):
+    """
+    Runs in the stage executor processes. The model is kept loaded in the process (see model_registry).
+    Classifiers supporting batches classify the files in batches of settings.CLASSIFIER_BATCH_SIZE, with the inputs of the next batches prepared in background
+    """
+    batch_predictor = get_batch_predictor(classifier, classifier_script)
+    if batch_predictor is None:
+        classify = get_predictor(classifier, classifier_script)
+        return [timed(classify, file_path) for file_path in file_paths]
+
+    classify_batch, prepare = batch_predictor
+    outcomes = []
+    for batch, prepared in prefetched_batches(file_paths, settings.CLASSIFIER_BATCH_SIZE, prepare):
+        batch_outcomes = [(None, f'Failed to read the file: {ex}' if ex is not None else None, 0) for _, ex in prepared]
+        ready = [index for index, (_, ex) in enumerate(prepared) if ex is None]
+        if ready:
+            results, error, duration = timed(classify_batch, [prepared[index][0] for index in ready])
+            if error is None and len(results) != len(ready):
+                error = f'Expected {len(ready)} results, got {len(results)}'
+            for position, index in enumerate(ready):
+                batch_outcomes[index] = (None if error else results[position], error, duration / len(ready))
+        outcomes.extend(batch_outcomes)
+    return outcomes
+
+
 @app.task(bind=True)
+@buffered_log('classify')
 def run_classifiers(self, filter_result, context_id):
     stage = 'classify'
     context = SearchContext.objects.get(id=context_id)
@@ -15,7 +78,7 @@ def run_classifiers(self, filter_result, context_id):
     if filter_result is not True:
         return False
 
-    datastream = context.datastream.filter(filtered=False)  # only use non filtered data objects
+    datastream = context.datastream.unfiltered()  # only use non filtered data objects
     advanced_configuration = context.configuration.advanced_configuration
 
     if datastream.count() == 0:
@@ -30,44 +93,77 @@ def run_classifiers(self, filter_result, context_id):
 
     change_status(SearchContext.CLASSIFYING, context, stage, f'Will use the classifiers: {classifiers}', True)
 
+    return run_stage(self, classify_objects, finish_classifying, id_ranges(datastream), context_id)
+
+
+@app.task(bind=True)
+@buffered_log('classify')
+def classify_objects(self, first_id, last_id, context_id):
+    """Runs the classifiers on the (non filtered) data objects with ids between first_id and last_id. Returns the number of results"""
+    stage = 'classify'
+    context = SearchContext.objects.get(id=context_id)
+
+    if context.is_stopped:
+        return 0
+
+    datastream = context.datastream.unfiltered().in_id_range(first_id, last_id)
+    classifiers = context.configuration.advanced_configuration.classifiers.filter(is_active=True)
     classified_count = 0
     for classifier in classifiers:
-        write_log(context, stage, f'Using classifier \'{classifier}\'')
+        write_log(context, stage, f'Using classifier \'{classifier}\' on objects {first_id} to {last_id}')
         if classifier.type == classifier.PYTHON_SCRIPT:
-            spec = importlib.util.spec_from_file_location(classifier.name, classifier.path)
-            classifier_script = importlib.util.module_from_spec(spec)
-            spec.loader.exec_module(classifier_script)
-
-            datastream_size = datastream.count()
-            failures = 0
-            failure_tolerance = 10  # if more than 10 failures occur, probably this classifier is not doing something right
-            for index, data in enumerate(datastream):
-                if failures > failure_tolerance:
-                    write_log(context, stage, f'[ERROR] Classifier {classifier} raised too many exceptions. Aborting its execution')
-                    break
-
+            classifier_script = load_plugin(classifier.name, classifier.path)
+
+            model_version = plugin_version(classifier, classifier_script)
+            pending = unclassified(datastream, classifier, model_version)
+            pending_size = pending.count()
+            already_classified = datastream.count() - pending_size
+            if already_classified > 0:
+                write_log(context, stage, f'{already_classified} objects were already classified by \'{classifier}\' (version {model_version})')
+            if pending_size == 0:
+                continue
+
+            if settings.STAGE_PROCESSES['classify'] <= 1:
                 try:
-                    classification_result = data.classification_result
-                    write_log(context, stage, f'Classifying {data.identifier} ({index + 1}/{datastream_size})')
-
-                    if classification_result is None or classification_result[classifier.name] is None:
-                        result = classifier_script.main(data.data)
-                        write_log(context, stage, f'Classification {data.identifier} result: {result}')
-                        classified_count += 1
+                    # Loads the model in this process, where the objects are classified
+                    get_predictor(classifier, classifier_script)
+                except Exception as ex:
+                    write_log(context, stage, f'[ERROR] Classifier {classifier} failed to load its model. Skipping it')
+                    print(f"Classifier {classifier} failed to load:\n{ex}")
+                    continue
+
+            with ResultsWriter(context, classifier, model_version, datastream.model) as results_writer:
+                failures = 0
+                failure_tolerance = 10  # if more than 10 failures occur, probably this classifier is not doing something right
+                outcomes = run_plugin('classify', classifier, pending, lambda data: data.data, classify_chunk, (classifier,))
+                for index, (data, (result, error, duration)) in enumerate(outcomes):
+                    if failures > failure_tolerance:
+                        write_log(context, stage, f'[ERROR] Classifier {classifier} raised too many exceptions. Aborting its execution')
+                        break
+
+                    if error is not None:
+                        failures += 1
+                        write_log(context, stage, f'[ERROR] Classifier failed on {data.identifier}. Continuing...', obj=data.identifier)
+                        print(f"Classifier {classifier} failed:\n{error}")
+                        continue
+
+                    classified_count += 1
+                    results_writer.add_result(data, result)
+                    write_log(context, stage, f'Classification {data.identifier} ({index + 1}/{pending_size}) result: {result}', obj=data.identifier, duration=duration)
+                outcomes.close()
+    return classified_count
 
-                        data.classification_result = {classifier.name: result}
-                        data.save()
-                        write_log(context, stage, f'Saved classification of {data.identifier} result')
-                    else:
-                        write_log(context, stage, f'Object {data.identifier} was already classified')
 
-                except Exception as ex:
-                    failures += 1
+@app.task(bind=True)
+@buffered_log('classify')
+def finish_classifying(self, classified_counts, context_id):
+    stage = 'classify'
+    context = SearchContext.objects.get(id=context_id)
 
-                    write_log(context, stage, f'[ERROR] Classifier failed on {data.identifier}. Continuing...')
-                    print(f"Classifier {classifier} failed:\n{ex}")
+    if context.is_stopped:
+        return False
 
     change_status(SearchContext.FINISHED_CLASSIFYING, context, stage, 'Finished classifying')
-    write_log(context, stage, f'Classified {classified_count} out of {len(datastream)} objects')
+    write_log(context, stage, f'Classified {sum(classified_counts)} out of {context.datastream.unfiltered().count()} objects')
     write_log(context, stage, f'Following stage is providing')
     return True
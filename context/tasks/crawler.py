@@ -0,0 +1,78 @@
+"""
+Long-lived Scrapy runner.
+A CrawlerProcess starts (and stops) the Twisted reactor, which can't be restarted in the same process. Instead, the reactor is started once per worker
+process in a background thread (through crochet) and every crawl is submitted to it with a CrawlerRunner. Workers can then be reused between tasks.
+"""
+import logging
+import threading
+import crochet
+from django.conf import settings
+from scrapy.crawler import CrawlerRunner
+from scrapy.settings import Settings
+from twisted.internet.defer import DeferredList
+
+CrawlTimeoutError = crochet.TimeoutError
+
+_setup_lock = threading.Lock()
+_is_setup = False
+_runners = set()
+
+
+def setup():
+    """Starts the reactor thread. Done lazily, since threads don't survive the fork of the Celery worker processes"""
+    global _is_setup
+    with _setup_lock:
+        if not _is_setup:
+            crochet.setup()
+            _is_setup = True
+
+
+@crochet.run_in_reactor
+def _crawl(spider_name, crawler_settings, **spider_kwargs):
+    runner = CrawlerRunner(crawler_settings)
+    _runners.add(runner)
+    deferred = runner.crawl(spider_name, **spider_kwargs)
+    deferred.addBoth(lambda result: _runners.discard(runner) or result)
+    return deferred
+
+
+@crochet.run_in_reactor
+def _stop():
+    return DeferredList([runner.stop() for runner in list(_runners)])
+
+
+def _file_handler(crawler_settings):
+    """CrawlerRunner doesn't configure logging like CrawlerProcess, so LOG_FILE is honoured here for the duration of the crawl"""
+    handler = logging.FileHandler(crawler_settings.get('LOG_FILE'), encoding=crawler_settings.get('LOG_ENCODING'))
+    handler.setFormatter(logging.Formatter(crawler_settings.get('LOG_FORMAT'), crawler_settings.get('LOG_DATEFORMAT')))
+    handler.setLevel(crawler_settings.get('LOG_LEVEL'))
+    return handler
+
+
+def crawl(spider_name, crawler_settings: dict, timeout=None, **spider_kwargs):
+    """Runs the spider on the shared reactor and blocks until the crawl finishes. Raises CrawlTimeoutError if it takes longer than timeout seconds"""
+    setup()
+    timeout = timeout if timeout is not None else settings.GATHERER_CRAWL_TIMEOUT
+    # Crawls run on the reactor installed by crochet
+    crawler_settings = Settings({'TWISTED_REACTOR': None, **crawler_settings})
+
+    root_logger = logging.getLogger()
+    root_level = root_logger.level
+    handler = None
+    if crawler_settings.get('LOG_FILE'):
+        handler = _file_handler(crawler_settings)
+        root_logger.addHandler(handler)
+        root_logger.setLevel(logging.NOTSET)  # the handler level filters the records, like scrapy does
+
+    try:
+        result = _crawl(spider_name, crawler_settings, **spider_kwargs)
+        try:
+            result.wait(timeout)
+        except CrawlTimeoutError:
+            _stop().wait(60)
+            raise
+    finally:
+        if handler is not None:
+            root_logger.removeHandler(handler)
+            root_logger.setLevel(root_level)
+            handler.close()
@@ -18,7 +18,7 @@ def delete_context_folder(self, context_id):
 
     try:
         shutil.rmtree(context_folder)
-        shutil.rmtree(context_folder_static)
+        shutil.rmtree(context_folder_static, ignore_errors=True)  # doesn't exist if files are published internally
         return True
     except Exception as e:
         print(e)
@@ -0,0 +1,116 @@
+"""
+Runs the per-object work of post-processors, filters and classifiers in a pool of processes, so a stage can use several CPU cores.
+The data objects are sent to the pool in chunks of settings.STAGE_CHUNK_SIZE. The pools are kept between tasks, and each process keeps the plugin
+scripts it loaded. The number of processes of each plugin kind is configured in settings.STAGE_PROCESSES. With 1 process, chunks run in the task process.
+The pools are billiard pools (the multiprocessing fork used by celery), as the prefork workers are daemonic processes and the standard library
+doesn't allow them to have children. If a pool can't be started, the chunks run in the task process.
+"""
+import importlib.util
+import os
+import threading
+import time
+from collections import deque
+import billiard
+from billiard.exceptions import WorkerLostError
+from django.conf import settings
+
+_plugins = {}  # (path, modification time) -> loaded script, in each process
+_pools = {}  # plugin kind -> billiard pool
+_pools_lock = threading.Lock()
+# The processes of a pool belong to the process that started it
+os.register_at_fork(after_in_child=_pools.clear)
+
+
+def load_plugin(name, path):
+    key = (path, os.path.getmtime(path))
+    if key not in _plugins:
+        spec = importlib.util.spec_from_file_location(name, path)
+        script = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(script)
+        _plugins[key] = script
+    return _plugins[key]
+
+
+def timed(function, *args):
+    """Calls function. Returns a (result, error, duration) outcome, where error is the exception message (or None)"""
+    start = time.monotonic()
+    try:
+        return function(*args), None, time.monotonic() - start
+    except Exception as ex:
+        return None, f'{type(ex).__name__}: {ex}', time.monotonic() - start
+
+
+def run_chunk(work, name, path, inputs, args):
+    """Runs work(script, inputs, *args) in the current process. work must return one outcome per input"""
+    try:
+        script = load_plugin(name, path)
+    except Exception as ex:
+        return [(None, f'Failed to load {name}: {type(ex).__name__}: {ex}', 0)] * len(inputs)
+    try:
+        return work(script, inputs, *args)
+    except Exception as ex:
+        return [(None, f'{type(ex).__name__}: {ex}', 0)] * len(inputs)
+
+
+def get_pool(kind):
+    with _pools_lock:
+        pool = _pools.get(kind, None)
+        if pool is None:
+            # Forked, so the processes inherit the configured Django settings. Work functions don't use the database
+            # Processes that die (e.g.: out of memory) are replaced by the pool, and their chunk fails with WorkerLostError
+            pool = billiard.get_context('fork').Pool(settings.STAGE_PROCESSES[kind])
+            _pools[kind] = pool
+        return pool
+
+
+def run_in_process(object_chunks, input_chunks, plugin, work, args):
+    for chunk, inputs in zip(object_chunks, input_chunks):
+        yield from zip(chunk, run_chunk(work, plugin.name, plugin.path, inputs, args))
+
+
+def chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def run_plugin(kind, plugin, objects, to_input, work, args=()):
+    """
+    Runs the plugin on the objects. Yields an (object, (result, error, duration)) pair for each object, in order.
+    to_input(object) returns what is sent to work (it must be picklable, e.g.: the file path). work(script, inputs, *args) is a module-level
+    function returning one outcome per input. If the caller stops iterating (e.g.: too many failures), no more chunks are sent to the pool.
+    """
+    objects = list(objects)
+    object_chunks = list(chunks(objects, settings.STAGE_CHUNK_SIZE))
+    input_chunks = ([to_input(obj) for obj in chunk] for chunk in object_chunks)
+
+    if settings.STAGE_PROCESSES[kind] <= 1:
+        yield from run_in_process(object_chunks, input_chunks, plugin, work, args)
+        return
+
+    try:
+        pool = get_pool(kind)
+    except Exception as ex:
+        print(f'Failed to start the {kind} processes, running in the task process: {type(ex).__name__}: {ex}')
+        yield from run_in_process(object_chunks, input_chunks, plugin, work, args)
+        return
+
+    in_flight = deque()
+    max_in_flight = settings.STAGE_PROCESSES[kind] * 2
+    chunks_iter = iter(zip(object_chunks, input_chunks))
+    while True:
+        while len(in_flight) < max_in_flight:
+            next_chunk = next(chunks_iter, None)
+            if next_chunk is None:
+                break
+            chunk, inputs = next_chunk
+            in_flight.append((chunk, pool.apply_async(run_chunk, (work, plugin.name, plugin.path, inputs, args))))
+
+        if not in_flight:
+            return
+
+        chunk, result = in_flight.popleft()
+        try:
+            outcomes = result.get()
+        except WorkerLostError as ex:
+            outcomes = [(None, f'{type(ex).__name__}: {ex}', 0)] * len(chunk)
+        yield from zip(chunk, outcomes)
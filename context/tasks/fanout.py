@@ -0,0 +1,37 @@
+"""
+Fan-out of the gathering, post-processing, filtering and classification stages.
+The work of a stage is split in ranges (of data object ids, or of lines of the URLs file) and each range is processed by a chunk task.
+When there is more than one range, the stage task is replaced by a chord: the chunk tasks run in parallel on any worker consuming their queue,
+and a finish task receives the list of their results and continues the chain. Otherwise, the chunk and finish tasks run in the stage task.
+"""
+from celery import chord
+from django.conf import settings
+
+
+def split_ids(ids, chunk_size):
+    """Splits the ordered ids in (first id, last id) ranges of at most chunk_size ids (a single range if chunk_size is 0)"""
+    ids = list(ids)
+    chunk_size = chunk_size or len(ids) or 1
+    return [(ids[i], ids[min(i + chunk_size, len(ids)) - 1]) for i in range(0, len(ids), chunk_size)]
+
+
+def id_ranges(queryset, chunk_size=None):
+    chunk_size = settings.STAGE_FANOUT_CHUNK_SIZE if chunk_size is None else chunk_size
+    return split_ids(queryset.ids(), chunk_size)
+
+
+def line_ranges(count, chunk_size=None):
+    """Splits count lines in (start, stop) ranges of at most chunk_size lines"""
+    chunk_size = settings.GATHER_FANOUT_CHUNK_SIZE if chunk_size is None else chunk_size
+    chunk_size = chunk_size or count or 1
+    return [(start, min(start + chunk_size, count)) for start in range(0, count, chunk_size)]
+
+
+def run_stage(task, chunk_task, finish_task, ranges, context_id):
+    """Runs chunk_task(first, last, context_id) on each range, then finish_task(chunk results, context_id). task is the stage task (bound)"""
+    if len(ranges) > 1:
+        raise task.replace(chord(
+            [chunk_task.s(first, last, context_id) for first, last in ranges],
+            finish_task.s(context_id)
+        ))
+    return finish_task([chunk_task(first, last, context_id) for first, last in ranges], context_id)
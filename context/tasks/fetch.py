@@ -1,34 +1,67 @@
+import hashlib
 import importlib.util
+import json
 import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from datetime import date, timedelta
 from django.conf import settings
-from datetime import datetime
-from context.models import APIResults, Configuration, AdvancedConfiguration, SearchContext, Fetcher
-import ast
+from django.db.models import Sum
+from django.utils import timezone
+from context.models import FetchCache, Configuration, AdvancedConfiguration, SearchContext, Fetcher
 from collections import OrderedDict
-from context.tasks.helpers import change_status, write_log
+from itertools import islice
+from context.tasks.helpers import buffered_log, change_status, write_log, urls_file_path, read_urls_file
 from maestro.celery import app
 
 
-def save_api_result_to_cache(fetcher, configuration, urls):
-    # Write in file
-    folder = os.path.join(settings.LOGS_PATH, 'apis')
-    file_name = f'{datetime.now().strftime("%Y-%m-%d_%H:%M:%S")}_{fetcher.name.replace(" ", "_")}.json'
-    full_path = os.path.join(folder, file_name)
-    with open(full_path, 'w') as f:
-        f.write(str(urls))
-    # Save in database
-    APIResults.objects.create(fetcher=fetcher, configuration=configuration, result_file=full_path)
-
-
-def cached_fetcher_urls(fetcher, data):
-    try:
-        api_result = APIResults.objects.get(fetcher=fetcher, configuration=data)
-        file = api_result.result_file
-        with open(file, 'r') as f:
-            list_str = f.read()
-        return ast.literal_eval(list_str)
-    except:
+def normalize_parameter(value):
+    if isinstance(value, str):
+        return ' '.join(value.lower().split())
+    if isinstance(value, (list, tuple, set)):
+        return sorted(normalize_parameter(element) for element in value)
+    if isinstance(value, date):  # includes datetimes
+        return value.isoformat()
+    return value
+
+
+def cache_key(fetcher_params):
+    """Hash of the fetcher parameters, normalized so that equivalent queries (e.g.: keywords in a different order) share the same key"""
+    normalized = {name: normalize_parameter(value) for name, value in fetcher_params.items()}
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def evict_api_results():
+    """Removes the expired results and, if the cache still holds more than settings.FETCH_CACHE_MAX_URLS, the least recently updated ones"""
+    FetchCache.objects.filter(expire_date__lte=timezone.now()).delete()
+    total = FetchCache.objects.aggregate(total=Sum('size'))['total'] or 0
+    evicted = []
+    for api_result in FetchCache.objects.order_by('update_date').values('id', 'size').iterator():
+        if total <= settings.FETCH_CACHE_MAX_URLS:
+            break
+        evicted.append(api_result['id'])
+        total -= api_result['size']
+    if evicted:
+        FetchCache.objects.filter(id__in=evicted).delete()
+
+
+def save_api_result_to_cache(fetcher, fetcher_params, urls):
+    if fetcher.cache_ttl <= 0:
+        return
+    FetchCache.objects.update_or_create(fetcher=fetcher, key=cache_key(fetcher_params), defaults={
+        'urls': urls,
+        'size': len(urls),
+        'expire_date': timezone.now() + timedelta(seconds=fetcher.cache_ttl)
+    })
+    evict_api_results()
+
+
+def cached_fetcher_urls(fetcher, fetcher_params):
+    if fetcher.cache_ttl <= 0:
         return None
+    return FetchCache.objects.filter(fetcher=fetcher, key=cache_key(fetcher_params), expire_date__gt=timezone.now()).values_list('urls', flat=True).first()
 
 
 def fetcher_parameters(configuration: Configuration, advanced_configuration: AdvancedConfiguration):
@@ -39,18 +72,130 @@ def fetcher_parameters(configuration: Configuration, advanced_configuration: Adv
         'keywords': keywords,
         'start_date': advanced_configuration.start_date if advanced_configuration and advanced_configuration.start_date else None,
         'end_date': advanced_configuration.end_date if advanced_configuration and advanced_configuration.end_date else None,
-        'country_code': country_code
+        'country_code': country_code,
+        'max_urls': url_budget(advanced_configuration)
     })
 
 
+def url_budget(advanced_configuration: AdvancedConfiguration):
+    if advanced_configuration and advanced_configuration.max_urls:
+        return advanced_configuration.max_urls
+    return settings.FETCHER_URL_BUDGET
+
+
+def load_fetcher_script(fetcher):
+    spec = importlib.util.spec_from_file_location(fetcher.name, fetcher.path)
+    fetcher_script = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(fetcher_script)
+    return fetcher_script
+
+
+def fetcher_pages(fetcher_script, fetcher_params):
+    """Fetchers can optionally implement main_pages, a generator that yields the URLs page by page. Otherwise, main's result is a single page"""
+    if hasattr(fetcher_script, 'main_pages'):
+        return fetcher_script.main_pages(fetcher_params)
+    return iter([fetcher_script.main(fetcher_params)])
+
+
+class FetcherRun:
+    """
+    Streams the URLs of a fetcher to its own file, page by page, until it has max_urls URLs.
+    Once stopped (e.g.: because it timed out), nothing else is written, so the file can be safely read by another thread.
+    Each run is limited only by its own max_urls (part of the cache key), so its URLs don't depend on the other fetchers and can be cached.
+    """
+
+    def __init__(self, fetcher, urls_file, max_urls):
+        self.fetcher = fetcher
+        self.urls_file = urls_file
+        self.max_urls = max_urls
+        self.count = 0
+        self._stopped = False
+        self._lock = threading.Lock()
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+
+    def write_page(self, f, page):
+        """Writes the page and returns whether the next page should be fetched"""
+        with self._lock:
+            if self._stopped:
+                return False
+            taken = min(len(page), self.max_urls - self.count)
+            f.writelines(f'{url}\n' for url in page[:taken])
+            f.flush()
+            self.count += taken
+            return self.count < self.max_urls
+
+    def write_urls(self, urls):
+        with open(self.urls_file, 'w') as f:
+            self.write_page(f, urls)
+        self.stop()
+        return self.count
+
+    def __call__(self, fetcher_params):
+        fetcher_script = load_fetcher_script(self.fetcher)
+        pages = fetcher_pages(fetcher_script, fetcher_params)
+        try:
+            with open(self.urls_file, 'w') as f:
+                for page in pages:
+                    if not self.write_page(f, page):
+                        break
+        finally:
+            if hasattr(pages, 'close'):
+                pages.close()
+        self.stop()
+        return self.count
+
+
+def merge_urls(runs, max_urls, f):
+    """Writes the URLs of the runs to f, in the runs order, up to max_urls URLs in total (the budget of the context). Returns the number of URLs written"""
+    written = 0
+    for run in runs:
+        if written >= max_urls or not os.path.exists(run.urls_file):
+            continue
+        with open(run.urls_file, 'r') as run_file:
+            urls = list(islice(run_file, max_urls - written))
+        f.writelines(urls)
+        written += len(urls)
+    return written
+
+
+def call_fetchers_concurrently(runs, fetcher_params):
+    """
+    Calls the fetchers in a thread pool, since they are mostly waiting on HTTP requests. Each fetcher has until its own timeout (counted from the start) to finish.
+    Returns a dict with the number of URLs written by each fetcher run, or the exception it raised (TimeoutError if it didn't finish in time).
+    """
+    if len(runs) == 0:
+        return {}
+
+    outcomes = {}
+    executor = ThreadPoolExecutor(max_workers=len(runs), thread_name_prefix='fetcher')
+    start = time.monotonic()
+    futures = {run: executor.submit(run, fetcher_params) for run in runs}
+    for run, future in futures.items():
+        remaining = run.fetcher.timeout - (time.monotonic() - start)
+        try:
+            outcomes[run] = future.result(timeout=max(remaining, 0))
+        except Exception as ex:  # includes TimeoutError
+            outcomes[run] = ex
+            run.stop()
+    # Don't wait for fetchers that timed out. They are stopped, so they won't write anything else
+    executor.shutdown(wait=False, cancel_futures=True)
+    return outcomes
+
+
 @app.task(bind=True)
+@buffered_log('fetch')
 def run_fetchers(self, context_id):
     stage = 'fetch'
-    list_of_urls = []
 
     context = SearchContext.objects.get(id=context_id)
 
     if context.is_stopped:
+        if context.status == SearchContext.WAITING_ITERATION and context.next_run_at is None:
+            # Stopped after being started by the scheduler: the iteration is due again, and is started by the scheduler once the context is resumed
+            SearchContext.objects.filter(id=context.id, next_run_at=None).update(next_run_at=timezone.now())
         return False
 
     context.number_of_iterations = context.number_of_iterations + 1
@@ -62,44 +207,55 @@ def run_fetchers(self, context_id):
     advanced_configuration = context.configuration.advanced_configuration
 
     if advanced_configuration:
-        fetchers = list(advanced_configuration.fetchers.filter(is_active=True))
+        fetchers = list(advanced_configuration.fetchers.filter(is_active=True).order_by('id'))
     else:
-        fetchers = list(Fetcher.objects.filter(is_active=True, is_default=True))
+        fetchers = list(Fetcher.objects.filter(is_active=True, is_default=True).order_by('id'))
 
     write_log(context, stage, f'Will use these fetchers: {fetchers}')
 
+    fetcher_params = fetcher_parameters(configuration, advanced_configuration)
+    max_urls = fetcher_params['max_urls']
+    write_log(context, stage, f'Up to {max_urls} URLs will be fetched')
+
+    # Each fetcher streams its URLs to its own file. They are merged in the fetchers order, so that the final list of URLs is deterministic
+    fetch_folder = os.path.join(context.context_folder, 'fetch')
+    os.makedirs(fetch_folder, exist_ok=True)
+    runs = []
+    runs_to_call = []
     for fetcher in fetchers:
         write_log(context, stage, f'Using fetcher \'{fetcher}\'')
         if fetcher.type == Fetcher.PYTHON_SCRIPT:
-            spec = importlib.util.spec_from_file_location(fetcher.name, fetcher.path)
-            fetcher_script = importlib.util.module_from_spec(spec)
-            spec.loader.exec_module(fetcher_script)
-
-            fetcher_params = fetcher_parameters(configuration, advanced_configuration)
+            run = FetcherRun(fetcher, os.path.join(fetch_folder, f'urls_{fetcher.id}.txt'), max_urls)
+            runs.append(run)
             cached_urls = cached_fetcher_urls(fetcher, fetcher_params)
 
             if cached_urls is not None:
-                write_log(context, stage, f'Another context has already made the same query: using {len(cached_urls)} cached URLs')
-                list_of_urls.extend(cached_urls)
+                write_log(context, stage, f'Another context has already made the same query: using {run.write_urls(cached_urls)} cached URLs')
             else:
-                try:
-                    result = fetcher_script.main(fetcher_params)
-                    write_log(context, stage, f'Fetched {len(result)} new URLs')
-                    list_of_urls.extend(result)
-                    write_log(context, stage, f'Current total number of URLs: {list_of_urls}')
-                    save_api_result_to_cache(fetcher, fetcher_params, result)
-                except Exception as ex:
-                    print(f"Fetcher {fetcher} failed:\n{ex}")  # later, log this to a system log
-                    write_log(context, stage, f'[ERROR] Fetcher \'{fetchers}\' failed. Continuing...')
-
-    if advanced_configuration and advanced_configuration.seed_urls != []:
-        list_of_urls.extend(advanced_configuration.seed_urls)
-        write_log(context, stage, f'The user provided \'{len(advanced_configuration.seed_urls)}\' additional seed URLs')
-
-    # Save urls to context folder
-    with open(f'{context.context_folder}/urls.txt', 'w') as f:
-        f.write(str(list_of_urls))
-
-    write_log(context, stage, f'The final number of URLs is: {len(list_of_urls)}')
+                runs_to_call.append(run)
+
+    outcomes = call_fetchers_concurrently(runs_to_call, fetcher_params)
+    for run, outcome in outcomes.items():
+        if isinstance(outcome, TimeoutError):
+            write_log(context, stage, f'[ERROR] Fetcher \'{run.fetcher}\' took more than {run.fetcher.timeout} seconds. Using the {run.count} URLs fetched until then')
+        elif isinstance(outcome, Exception):
+            print(f"Fetcher {run.fetcher} failed:\n{outcome}")  # later, log this to a system log
+            write_log(context, stage, f'[ERROR] Fetcher \'{run.fetcher}\' failed after fetching {run.count} URLs. Continuing...')
+        else:
+            write_log(context, stage, f'Fetcher \'{run.fetcher}\' fetched {outcome} new URLs')
+            save_api_result_to_cache(run.fetcher, fetcher_params, read_urls_file(run.urls_file))
+
+    # Merge the URLs in the context's URLs file. The budget of the context is shared by the fetchers, in the fetchers order
+    with open(urls_file_path(context), 'w') as f:
+        urls_count = merge_urls(runs, max_urls, f)
+        write_log(context, stage, f'Current total number of URLs: {urls_count}')
+
+        if advanced_configuration and advanced_configuration.seed_urls:
+            f.writelines(f'{url}\n' for url in advanced_configuration.seed_urls)
+            urls_count += len(advanced_configuration.seed_urls)
+            write_log(context, stage, f'The user provided \'{len(advanced_configuration.seed_urls)}\' additional seed URLs')
+    shutil.rmtree(fetch_folder, ignore_errors=True)
+
+    write_log(context, stage, f'The final number of URLs is: {urls_count}')
     change_status(SearchContext.FINISHED_FETCHING_URLS, context, stage, 'Finished fetching URLs. Will now gather')
-    return list_of_urls
+    return True
@@ -1,6 +1,10 @@
-import importlib.util
+import hashlib
+import json
 from context.models import SearchContext, AdvancedConfiguration, Filter
-from context.tasks.helpers import change_status, write_log
+from context.tasks.executor import load_plugin, run_plugin, timed
+from context.tasks.fanout import id_ranges, run_stage
+from context.tasks.helpers import buffered_log, change_status, write_log, BulkUpdater
+from context.tasks.model_registry import plugin_version
 from maestro.celery import app
 
 
@@ -15,20 +19,19 @@ def get_used_builtin_filters(config: AdvancedConfiguration):
     return filter_list
 
 
-@app.task(bind=True)
-def run_filters(self, post_process_result, context_id):
-    stage = 'filter'
-    context = SearchContext.objects.get(id=context_id)
+def filter_chunk(filter_script, inputs, filterable_data):
+    """Runs in the stage executor processes"""
+    return [timed(filter_script.main, file_path, metadata, filterable_data) for file_path, metadata in inputs]
 
-    if context.is_stopped:
-        return False
 
-    if post_process_result is not True:  # something went wrong on the post-processors stage
-        return False
+def filter_version(_filter, filter_script, filterable_data, strict_filtering):
+    """Version of the filter script and of the configuration it filters with. The objects are filtered again when either changes"""
+    configuration = json.dumps([filterable_data, strict_filtering], sort_keys=True, default=str)
+    return f'{plugin_version(_filter, filter_script)}:{hashlib.sha256(configuration.encode("utf-8")).hexdigest()[:12]}'
 
-    datastream = context.datastream
-    advanced_configuration = context.configuration.advanced_configuration
 
+def get_filters(advanced_configuration):
+    """Filters used by the context (None if there are none)"""
     if advanced_configuration is not None and advanced_configuration.filters is not None:
         custom_selected_filters = set(advanced_configuration.filters.filter(is_active=True, is_builtin=False))
         builtin_filters = get_used_builtin_filters(advanced_configuration)
@@ -36,52 +39,102 @@ def run_filters(self, post_process_result, context_id):
     elif advanced_configuration is not None and advanced_configuration.filters is None:
         filters = get_used_builtin_filters(advanced_configuration)
     else:
-        change_status(SearchContext.FINISHED_FILTERING, context, stage, f'No filters used. Continuing to classification', True)
-        return True
+        return None
+    return filters if len(filters) > 0 else None
+
+
+@app.task(bind=True)
+@buffered_log('filter')
+def run_filters(self, post_process_result, context_id):
+    stage = 'filter'
+    context = SearchContext.objects.get(id=context_id)
+
+    if context.is_stopped:
+        return False
+
+    if post_process_result is not True:  # something went wrong on the post-processors stage
+        return False
+
+    filters = get_filters(context.configuration.advanced_configuration)
 
     # No filters selected
-    if filters is None or len(filters) == 0:
+    if filters is None:
         change_status(SearchContext.FINISHED_FILTERING, context, stage, f'No filters used. Continuing to classification', True)
         return True
 
     change_status(SearchContext.FILTERING, context, stage, f'Will use the filters: {filters}', True)
 
+    return run_stage(self, filter_objects, finish_filtering, id_ranges(context.datastream), context_id)
+
+
+@app.task(bind=True)
+@buffered_log('filter')
+def filter_objects(self, first_id, last_id, context_id):
+    """Runs the filters on the data objects with ids between first_id and last_id. Returns the number of objects filtered out"""
+    stage = 'filter'
+    context = SearchContext.objects.get(id=context_id)
+
+    if context.is_stopped:
+        return 0
+
+    datastream = context.datastream.in_id_range(first_id, last_id)
+    advanced_configuration = context.configuration.advanced_configuration
     filterable_data = advanced_configuration.get_filterable_data()
     filtered_count = 0
-    for _filter in filters:
-        write_log(context, stage, f'Using filter \'{_filter}\'')
+    for _filter in get_filters(advanced_configuration) or []:
+        write_log(context, stage, f'Using filter \'{_filter}\' on objects {first_id} to {last_id}')
         if _filter.type == Filter.PYTHON_SCRIPT:
-            spec = importlib.util.spec_from_file_location(_filter.name, _filter.path)
-            filter_script = importlib.util.module_from_spec(spec)
-            spec.loader.exec_module(filter_script)
-
+            # Objects filtered by this version of the filter (with the same configuration) in previous iterations are skipped
+            try:
+                version = filter_version(_filter, load_plugin(_filter.name, _filter.path), filterable_data, advanced_configuration.strict_filtering)
+            except Exception as ex:
+                write_log(context, stage, f'[ERROR] Filter {_filter} failed to load. Skipping it')
+                print(f"Filter {_filter} failed to load:\n{ex}")
+                continue
+            pending = datastream.not_seen_by(stage, _filter, version)
+            already_filtered = datastream.count() - pending.count()
+            if already_filtered > 0:
+                write_log(context, stage, f'{already_filtered} objects were already filtered by \'{_filter}\' in previous iterations')
+            updater = BulkUpdater(datastream.model, ['filtered', 'stage_watermarks'])
             failures = 0
             failure_tolerance = 10  # if more than 10 failures occur, probably this filter is not doing something right
-            for data in datastream:
+            outcomes = run_plugin('filter', _filter, pending, lambda data: (data.data, data.metadata), filter_chunk, (filterable_data,))
+            for data, (result, error, duration) in outcomes:
                 if failures > failure_tolerance:
                     write_log(context, stage, f'[ERROR] Filter {_filter} raised too many exceptions. Aborting its execution')
                     break
 
-                try:
-                    write_log(context, stage, f'Filtering {data.identifier}')
-                    result = filter_script.main(data.data, data.metadata, filterable_data)
-                    write_log(context, stage, f'{data.identifier} {"was" if result else "was not"} filtered')
-                    if (result is None and advanced_configuration.strict_filtering is True) or (result is False):
-                        # Mark the data object as filtered
-                        filtered_count += 1
-                        data.filtered = True
-                        data.save()
-                    else:
-                        data.filtered = False
-                        data.save()
-                    write_log(context, stage, f'Saved filtering of {data.identifier} result')
-                except Exception as ex:
+                if error is not None:
                     # Filters shouldn't return exceptions, but it's safer to catch if one occurs
                     failures += 1
-                    write_log(context, stage, f'[ERROR] Filter failed on {data.identifier}. Continuing...')
-                    print(f"Filter {_filter} failed:\n{ex}")
+                    write_log(context, stage, f'[ERROR] Filter failed on {data.identifier}. Continuing...', obj=data.identifier)
+                    print(f"Filter {_filter} failed:\n{error}")
+                    continue
+
+                if (result is None and advanced_configuration.strict_filtering is True) or (result is False):
+                    # Mark the data object as filtered
+                    filtered_count += 1
+                    data.filtered = True
+                else:
+                    data.filtered = False
+                data.mark_seen(stage, _filter, version)
+                updater.add(data)
+                write_log(context, stage, f'{data.identifier} {"was" if result else "was not"} filtered', obj=data.identifier, duration=duration)
+            outcomes.close()
+            updater.flush()
+    return filtered_count
+
+
+@app.task(bind=True)
+@buffered_log('filter')
+def finish_filtering(self, filtered_counts, context_id):
+    stage = 'filter'
+    context = SearchContext.objects.get(id=context_id)
+
+    if context.is_stopped:
+        return False
 
     change_status(SearchContext.FINISHED_FILTERING, context, stage, 'Finished filtering')
-    write_log(context, stage, f'Filtered {filtered_count} out of {len(datastream)} objects')
+    write_log(context, stage, f'Filtered {sum(filtered_counts)} out of {context.datastream.count()} objects')
     write_log(context, stage, f'Following stage is classification')
     return True
@@ -1,28 +1,53 @@
 import os
-import shutil
-from context.models import SearchContext, THUMB_SIZE, Configuration, ImageData, SoundData
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from context.models import SearchContext, THUMB_SIZE, Configuration
 from datetime import datetime
-from scrapy.crawler import CrawlerProcess
 from django.conf import settings
 import importlib.util
 
-from context.tasks.helpers import change_status, write_log
+from context.tasks import crawler
+from context.tasks.fanout import line_ranges, run_stage
+from context.tasks.ingest import ingest_images, ingest_sounds
+from context.tasks.helpers import buffered_log, change_status, write_log, iter_urls
 from maestro.celery import app
 
 
+def gather_sounds(gatherer, urls, dest_path, log_file):
+    """Downloads the sounds concurrently, writing the outcome of each URL to log_file. Returns the paths of the downloaded sounds"""
+    def gather(url):
+        return url, gatherer.gather(url, dest_path)
+
+    sound_paths = []
+    with ThreadPoolExecutor(max_workers=settings.SOUND_GATHERER_WORKERS) as executor, open(log_file, 'w') as log:
+        for url, (sound_path, reason) in executor.map(gather, urls):
+            if sound_path is not None:
+                sound_paths.append(sound_path)
+                log.write(f'[OK] {url} -> {os.path.basename(sound_path)}\n')
+            else:
+                log.write(f'[SKIPPED] {url}: {reason}\n')
+    return sound_paths
+
+
 @app.task(bind=True)
-def run_default_gatherer(self, urls, context_id):
+@buffered_log('gather')
+def run_default_gatherer(self, fetch_result, context_id):
     stage = 'gather'
     context = SearchContext.objects.get(id=context_id)
 
     if context.is_stopped:
         return False
 
-    if len(urls) == 0:
+    if fetch_result is not True:  # something went wrong on the fetching stage
+        return False
+
+    # URLs are streamed from the file written by the fetching stage
+    urls_count = sum(1 for _ in iter_urls(context))
+    if urls_count == 0:
         change_status(SearchContext.FAILED_GATHERING_DATA, context, stage, '[ERROR] No URLs returned from the fetching stage', True)
         return False
 
-    change_status(SearchContext.GATHERING_DATA, context, stage, f'Started gathering data from {len(urls)} urls', True)
+    change_status(SearchContext.GATHERING_DATA, context, stage, f'Started gathering data from {urls_count} urls', True)
 
     # Create data store folder if not exists
     context_data_path = os.path.join(context.context_folder, 'data')
@@ -34,8 +59,33 @@ def run_default_gatherer(self, urls, context_id):
 
     write_log(context, stage, f'Folders to support data persistance created')
 
+    return run_stage(self, gather_urls, finish_gathering, line_ranges(urls_count), context_id)
+
+
+def load_sound_gatherer():
+    gatherer_path = os.path.join(settings.BASE_DIR, 'gatherers', 'defaultSoundGatherer.py')
+    spec = importlib.util.spec_from_file_location('defaultSoundGatherer', gatherer_path)
+    gatherer = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(gatherer)
+    return gatherer
+
+
+@app.task(bind=True)
+@buffered_log('gather')
+def gather_urls(self, start, stop, context_id):
+    """Gathers the data in the URLs of the lines start to stop (excluded) of the URLs file. Returns the number of sounds stored (images are stored by finish_gathering)"""
+    stage = 'gather'
+    context = SearchContext.objects.get(id=context_id)
+
+    if context.is_stopped:
+        return 0
+
+    context_data_path = os.path.join(context.context_folder, 'data')
+    context_log_path = os.path.join(context.context_folder, 'logs')
+    log_file = os.path.join(context_log_path, f'{datetime.now().strftime("%Y-%m-%d_%H:%M:%S")}_gatherer_{start}-{stop}.txt')
+    urls = islice(iter_urls(context), start, stop)
+
     if context.configuration.data_type == Configuration.IMAGES:
-        log_file = os.path.join(context_log_path, f'{datetime.now().strftime("%Y-%m-%d_%H:%M:%S")}_gatherer.txt')
         crawler_settings = {
             'SPIDER_MODULES': 'gatherers.defaultImageGatherer.defaultImageGatherer.spiders',
             'ITEM_PIPELINES': {
@@ -52,63 +102,43 @@ def run_default_gatherer(self, urls, context_id):
             'TELNETCONSOLE_ENABLED': False
         }
 
-        process = CrawlerProcess(crawler_settings)
-        process.crawl('defaultImageSpider', urls=urls)
-        process.start()
+        try:
+            crawler.crawl('defaultImageSpider', crawler_settings, urls=urls)
+        except crawler.CrawlTimeoutError:
+            write_log(context, stage, f'[ERROR] Gathering of the URLs {start} to {stop} stopped after {settings.GATHERER_CRAWL_TIMEOUT} seconds. Keeping what was downloaded')
+        return 0
+
+    elif context.configuration.data_type == Configuration.SOUNDS:
+        sound_paths = gather_sounds(load_sound_gatherer(), urls, context_data_path, log_file)
+        write_log(context, stage, f'Downloaded {len(sound_paths)} sounds from the URLs {start} to {stop} ({stop - start - len(sound_paths)} URLs skipped, see {os.path.basename(log_file)})')
+
+        # Publish sounds to the static folder and add entries to DB
+        return ingest_sounds(context, sound_paths)
+
+    return 0
+
+
+@app.task(bind=True)
+@buffered_log('gather')
+def finish_gathering(self, stored_counts, context_id):
+    stage = 'gather'
+    context = SearchContext.objects.get(id=context_id)
+
+    if context.is_stopped:
+        return False
 
+    if context.configuration.data_type == Configuration.IMAGES:
         # Copy thumbnails to the static folder and add entries to DB
+        context_data_path = os.path.join(context.context_folder, 'data')
         thumbs_folder = os.path.join(context_data_path, 'thumbs')
-        original_folder = os.path.join(context_data_path, 'full')
-        thumbs_static_folder = os.path.join(settings.STATIC_ROOT, context.owner_code, context.code)
-
         if os.path.isdir(thumbs_folder):
-            os.makedirs(thumbs_static_folder, exist_ok=True)
-            files = os.listdir(thumbs_folder)
-            write_log(context, stage, f'Downloaded {len(files)} images')
+            write_log(context, stage, f'Downloaded {len(os.listdir(thumbs_folder))} images')
             write_log(context, stage, f'Preparing and storing images on database')
-
-            objs = []
-            for file in files:
-                file_path_in_thumb_folder = os.path.join(thumbs_folder, file)
-                shutil.copy2(file_path_in_thumb_folder, thumbs_static_folder)
-                # Add entries to DB
-                obj = ImageData.objects.filter(context=context, data=os.path.join(original_folder, file))
-                if not obj.exists():
-                    objs.append(ImageData(
-                        context=context,
-                        data=os.path.join(original_folder, file),
-                        data_thumb=os.path.join(thumbs_folder, file),
-                        data_thumb_static=os.path.join(thumbs_static_folder, file)
-                    ))
-            ImageData.objects.bulk_create(objs)
+            created = ingest_images(context, context_data_path)
+            write_log(context, stage, f'Stored {created} new images')
 
     elif context.configuration.data_type == Configuration.SOUNDS:
-        gatherer_path = os.path.join(settings.BASE_DIR, 'gatherers', 'defaultSoundGatherer.py')
-        spec = importlib.util.spec_from_file_location('defaultSoundGatherer', gatherer_path)
-        gatherer = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(gatherer)
-
-        objs = []
-        for url in urls:
-            dest_path = os.path.join(context.context_folder, 'data')
-            os.makedirs(dest_path, exist_ok=True)
-            os.makedirs(context.context_folder_static, exist_ok=True)
-            try:
-                sound_path = gatherer.main(url, dest_path)
-                if sound_path is not None:
-                    sound_static_path = shutil.copy2(sound_path, context.context_folder_static)
-                    obj = SoundData.objects.filter(context=context, data=sound_path, data_static=sound_static_path)
-                    if not obj.exists():
-                        objs.append(SoundData(
-                            context=context,
-                            data=sound_path,
-                            data_static=sound_static_path
-                        ))
-            except:
-                pass
-
-            # Add entries to DB
-        SoundData.objects.bulk_create(objs)
+        write_log(context, stage, f'Stored {sum(stored_counts)} new sounds')
 
     change_status(SearchContext.FINISHED_GATHERING_DATA, context, stage, f'Finished gathering data')
 
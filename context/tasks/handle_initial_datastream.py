@@ -1,7 +1,7 @@
 import os
-import shutil
 
 from context.models import SearchContext, THUMB_SIZE, ImageData
+from context.tasks.ingest import register
 from maestro.celery import app
 import zipfile
 from PIL import Image
@@ -34,16 +34,17 @@ def handle_initial_datastream(self, context_id, initial_datastream):
     thumb_folder = os.path.join(context_folder, 'data', 'thumbs')
     os.makedirs(thumb_folder, exist_ok=True)
     os.makedirs(context_folder_static, exist_ok=True)
+    objs = []
     for file_name in zip_files_names:
         file_path = os.path.join(dest_folder, file_name)
         thumb_path = os.path.join(thumb_folder, file_name)
-        static_path = os.path.join(context_folder_static, file_name)
 
         generate_thumbnail(image_path=file_path, dest_folder=thumb_folder)
-        # Copy to static folder
-        shutil.copy(os.path.join(thumb_folder, file_name), context_folder_static)
-        # Create data objects
-        if not ImageData.objects.filter(context=context, data=file_path, data_thumb=thumb_path, data_thumb_static=static_path).exists():
-            ImageData.objects.create(context=context, data=file_path, data_thumb=thumb_path, data_thumb_static=static_path)
+        # Publish to static folder
+        static_path = context.publish_file(thumb_path)
+        objs.append(ImageData(context=context, data=file_path, data_thumb=thumb_path, data_thumb_static=static_path))
+
+    # Create data objects
+    register(ImageData, context, objs)
 
     return True
@@ -1,24 +1,137 @@
+import ast
+import functools
+import json
 import os
+import queue
+import threading
+import time
 from datetime import datetime
 import pathlib
+from django.conf import settings
 
 
 def get_stage_log_path(stage, context_log_path):
     return os.path.join(context_log_path, f'{stage}.log')
 
 
-def write_log(context, stage, message, override=False):
+ERROR_PREFIX = '[ERROR] '
+
+
+class StageLogger:
+    """
+    Writes the log of a pipeline stage as JSON lines ({"time", "level", "message"}, plus "object" and "duration" when given).
+    The file is kept open and writes are buffered. They are flushed every settings.STAGE_LOG_FLUSH_INTERVAL seconds, on errors and when closed.
+    Each flush appends whole lines with a single write, so several tasks of the same stage (see fanout.py) can log to the same file.
+    """
+
+    def __init__(self, log_file, override=False, flush_interval=None):
+        os.makedirs(pathlib.Path(log_file).parent.absolute(), exist_ok=True)
+        self.flush_interval = settings.STAGE_LOG_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self._file = open(log_file, 'wb' if override else 'ab', buffering=0)
+        self._buffer = []
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def write(self, message, override=False, obj=None, duration=None):
+        level = 'INFO'
+        if message.startswith(ERROR_PREFIX):
+            level = 'ERROR'
+            message = message[len(ERROR_PREFIX):]
+
+        entry = {'time': datetime.now().isoformat(timespec='seconds'), 'level': level, 'message': message}
+        if obj is not None:
+            entry['object'] = obj
+        if duration is not None:
+            entry['duration'] = round(duration, 3)
+        line = json.dumps(entry, default=str) + '\n'
+
+        with self._lock:
+            if override:
+                self._buffer = []
+                self._file.truncate(0)
+            self._buffer.append(line)
+            now = time.monotonic()
+            if level == 'ERROR' or now - self._last_flush >= self.flush_interval:
+                self._flush()
+                self._last_flush = now
+
+    def _flush(self):
+        if self._buffer:
+            self._file.write(''.join(self._buffer).encode('utf-8'))
+            self._buffer = []
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+_stage_loggers = {}  # (context id, stage) -> StageLogger (None until the first write), for the stages currently running in this process
+_stage_loggers_lock = threading.Lock()
+
+
+def buffered_log(stage):
+    """Task decorator. While the task runs, the log of the stage is kept open by a StageLogger. The context id must be the last argument of the task"""
+    def decorator(task):
+        @functools.wraps(task)
+        def wrapper(self, *args, **kwargs):
+            key = (kwargs['context_id'] if 'context_id' in kwargs else args[-1], stage)
+            with _stage_loggers_lock:
+                is_nested = key in _stage_loggers  # e.g.: chunk tasks called by the stage task (see fanout.py)
+                if not is_nested:
+                    _stage_loggers[key] = None
+            if is_nested:
+                return task(self, *args, **kwargs)
+            try:
+                return task(self, *args, **kwargs)
+            finally:
+                with _stage_loggers_lock:
+                    logger = _stage_loggers.pop(key, None)
+                if logger is not None:
+                    logger.close()
+        return wrapper
+    return decorator
+
+
+def write_log(context, stage, message, override=False, obj=None, duration=None):
     logs_path = os.path.join(context.context_folder, 'logs')
     log_file = get_stage_log_path(stage, logs_path)
-    now = datetime.now().strftime('%d-%m-%Y %H:%M:%S')
-    if os.path.exists(log_file):
-        mode = 'w' if override else 'a'
-        with open(log_file, mode) as f:
-            f.write(f'[{now}] {message}\n')
+
+    key = (context.id, stage)
+    with _stage_loggers_lock:
+        if key in _stage_loggers:
+            logger = _stage_loggers[key]
+            if logger is None:
+                logger = _stage_loggers[key] = StageLogger(log_file, override)
+        else:
+            logger = None
+
+    if logger is not None:
+        logger.write(message, override, obj, duration)
     else:
-        os.makedirs(pathlib.Path(log_file).parent.absolute(), exist_ok=True)
-        with open(log_file, 'w') as f:
-            f.write(f'[{now}] {message}\n')
+        with StageLogger(log_file, override) as logger:
+            logger.write(message, obj=obj, duration=duration)
+
+
+def render_log_line(line):
+    """Renders a JSON log line in the '[date time] [ERROR] message' format. Lines written by older versions are already in it"""
+    if not line.startswith('{'):
+        return line
+    try:
+        entry = json.loads(line)
+        date_time = datetime.fromisoformat(entry['time']).strftime('%d-%m-%Y %H:%M:%S')
+    except (ValueError, KeyError):
+        return line
+
+    level = ERROR_PREFIX if entry.get('level') == 'ERROR' else ''
+    duration = f' ({entry["duration"]}s)' if entry.get('duration') is not None else ''
+    return f'[{date_time}] {level}{entry.get("message", "")}{duration}\n'
 
 
 def read_log(context, stage):
@@ -26,12 +139,140 @@ def read_log(context, stage):
     log_file = get_stage_log_path(stage, logs_path)
     if os.path.exists(log_file):
         with open(log_file, 'r') as f:
-            return f.readlines()
+            return [render_log_line(line) for line in f]
     else:
         return None
 
 
+class BulkUpdater:
+    """
+    Collects modified objects and saves them with bulk_update, restricted to the given fields.
+    Objects are written every settings.RESULTS_COMMIT_INTERVAL objects and when the updater is closed, instead of one UPDATE (of every column) per object.
+    """
+
+    def __init__(self, model, fields, commit_interval=None):
+        self.model = model
+        self.fields = fields
+        self.commit_interval = commit_interval or settings.RESULTS_COMMIT_INTERVAL
+        self._pending = []
+
+    def add(self, obj):
+        self._pending.append(obj)
+        if len(self._pending) >= self.commit_interval:
+            self.flush()
+
+    def flush(self):
+        if self._pending:
+            self.model.objects.bulk_update(self._pending, self.fields, batch_size=self.commit_interval)
+            self._pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+
+class BulkCreator:
+    """Collects new objects and creates them with bulk_create every settings.RESULTS_COMMIT_INTERVAL objects and when the creator is closed. Objects that already exist are ignored"""
+
+    def __init__(self, model, commit_interval=None):
+        self.model = model
+        self.commit_interval = commit_interval or settings.RESULTS_COMMIT_INTERVAL
+        self._pending = []
+
+    def add(self, obj):
+        self._pending.append(obj)
+        if len(self._pending) >= self.commit_interval:
+            self.flush()
+
+    def flush(self):
+        if self._pending:
+            self.model.objects.bulk_create(self._pending, batch_size=self.commit_interval, ignore_conflicts=True)
+            self._pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+
+def urls_file_path(context):
+    return os.path.join(context.context_folder, 'urls.txt')
+
+
+def read_urls_file(path):
+    """Reads a URLs file (one URL per line). Files written by older versions, with a Python list, are also supported"""
+    with open(path, 'r') as f:
+        content = f.read()
+    if content.startswith('['):
+        return ast.literal_eval(content)
+    return content.splitlines()
+
+
+def iter_urls(context):
+    """Yields the URLs fetched for the context one at a time, without reading the whole file to memory"""
+    path = urls_file_path(context)
+    if not os.path.exists(path):
+        return
+    with open(path, 'r') as f:
+        first_line = f.readline()
+        if first_line.startswith('['):
+            yield from read_urls_file(path)
+            return
+        if first_line.strip():
+            yield first_line.strip()
+        for line in f:
+            if line.strip():
+                yield line.strip()
+
+
 def change_status(status, context, stage, message, override=False):
     context.status = status
     context.save()
     write_log(context, stage, message, override)
+
+
+def prefetched_batches(items, batch_size, prepare, prefetch=2):
+    """
+    Splits items in batches of batch_size, yielding (batch, prepared) tuples where prepared holds a (value, exception) pair per item of the batch.
+    Batches are prepared by a background thread, so that preparing the next batches (e.g.: decoding images) overlaps the processing of the current one.
+    prepare must not access the database, since it runs outside the task thread.
+    """
+    batches = queue.Queue(maxsize=prefetch)
+    stop = threading.Event()
+    done = object()
+
+    def put(element):
+        while not stop.is_set():
+            try:
+                batches.put(element, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def producer():
+        for start in range(0, len(items), batch_size):
+            batch = items[start:start + batch_size]
+            prepared = []
+            for item in batch:
+                try:
+                    prepared.append((prepare(item), None))
+                except Exception as ex:
+                    prepared.append((None, ex))
+            if not put((batch, prepared)):
+                return
+        put(done)
+
+    thread = threading.Thread(target=producer, daemon=True)
+    thread.start()
+    try:
+        while True:
+            element = batches.get()
+            if element is done:
+                return
+            yield element
+    finally:
+        stop.set()
@@ -0,0 +1,78 @@
+"""
+Registration of gathered files as data objects.
+Files are published (see context/publishing.py) with a thread pool, and objects are deduplicated against the ones already registered with a single query and created in batches.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from context.models import ImageData, SoundData
+
+
+def publish_file(context, source):
+    """Publishes source in the context static folder. Returns the published path, or None if publishing failed"""
+    try:
+        return context.publish_file(source)
+    except OSError as ex:
+        print(ex)
+        return None
+
+
+def publish_files(context, sources):
+    """Publishes the files concurrently. Returns the published paths, in the same order as sources (None for the ones that failed)"""
+    with ThreadPoolExecutor(max_workers=settings.INGESTION_WORKERS) as executor:
+        return list(executor.map(lambda source: publish_file(context, source), sources))
+
+
+def registered_paths(model, context):
+    return set(model.objects.filter(context=context).values_list('data', flat=True))
+
+
+def register(model, context, objs, existing=None):
+    """Creates the objects whose data path isn't registered in the context yet (existing, if already queried). Returns the number of objects created"""
+    existing = registered_paths(model, context) if existing is None else existing
+    new_objs = []
+    for obj in objs:
+        obj.refresh_identifier()  # bulk_create doesn't call save
+        if obj.data not in existing:
+            existing.add(obj.data)
+            new_objs.append(obj)
+    # ignore_conflicts covers objects registered concurrently (unique context+data)
+    model.objects.bulk_create(new_objs, batch_size=settings.INGESTION_BATCH_SIZE, ignore_conflicts=True)
+    return len(new_objs)
+
+
+def ingest_images(context, data_path):
+    """Registers the images downloaded by the image gatherer (full size in data_path/full, thumbnails in data_path/thumbs)"""
+    thumbs_folder = os.path.join(data_path, 'thumbs')
+    original_folder = os.path.join(data_path, 'full')
+    os.makedirs(context.context_folder_static, exist_ok=True)
+
+    existing = registered_paths(ImageData, context)
+    files = [file for file in os.listdir(thumbs_folder) if os.path.join(original_folder, file) not in existing]
+
+    static_paths = publish_files(context, [os.path.join(thumbs_folder, file) for file in files])
+    objs = [
+        ImageData(
+            context=context,
+            data=os.path.join(original_folder, file),
+            data_thumb=os.path.join(thumbs_folder, file),
+            data_thumb_static=static_path
+        )
+        for file, static_path in zip(files, static_paths) if static_path is not None
+    ]
+    return register(ImageData, context, objs, existing)
+
+
+def ingest_sounds(context, sound_paths):
+    """Registers the sounds downloaded by the sound gatherer"""
+    os.makedirs(context.context_folder_static, exist_ok=True)
+
+    existing = registered_paths(SoundData, context)
+    sound_paths = [path for path in dict.fromkeys(sound_paths) if path not in existing]
+
+    static_paths = publish_files(context, sound_paths)
+    objs = [
+        SoundData(context=context, data=sound_path, data_static=static_path)
+        for sound_path, static_path in zip(sound_paths, static_paths) if static_path is not None
+    ]
+    return register(SoundData, context, objs, existing)
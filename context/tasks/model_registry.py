@@ -0,0 +1,138 @@
+import gc
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from django.conf import settings
+
+
+def estimate_model_size(model):
+    """Best-effort estimation (in bytes) of the memory used by a loaded model. Models that can't be measured count as 0."""
+    if isinstance(model, (tuple, list)):
+        return sum(estimate_model_size(element) for element in model)
+
+    # PyTorch modules
+    if hasattr(model, 'parameters') and hasattr(model, 'buffers'):
+        try:
+            tensors = list(model.parameters()) + list(model.buffers())
+            return sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+        except Exception:
+            return 0
+
+    # Keras models (weights are float32)
+    if hasattr(model, 'count_params'):
+        try:
+            return model.count_params() * 4
+        except Exception:
+            return 0
+
+    return 0
+
+
+class ModelRegistry:
+    """
+    Keeps classifier models loaded in the worker process, so a model is loaded once per worker instead of once per data object.
+    When the estimated size of the loaded models exceeds the memory budget, the least recently used models are evicted.
+    """
+
+    def __init__(self, memory_budget):
+        self.memory_budget = memory_budget
+        self._models = OrderedDict()  # key -> (model, size)
+        self._lock = threading.RLock()
+
+    @property
+    def used_memory(self):
+        return sum(size for _, size in self._models.values())
+
+    def get(self, key, loader):
+        """Returns the model identified by key, calling loader() to load it if it isn't resident yet"""
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                return self._models[key][0]
+
+            model = loader()
+            size = estimate_model_size(model)
+            self._evict(size)
+            self._models[key] = (model, size)
+            return model
+
+    def evict(self, key):
+        with self._lock:
+            if self._models.pop(key, None) is not None:
+                gc.collect()
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+            gc.collect()
+
+    def _evict(self, incoming_size):
+        evicted = False
+        while self._models and self.used_memory + incoming_size > self.memory_budget:
+            self._models.popitem(last=False)
+            evicted = True
+        if evicted:
+            gc.collect()
+
+    def __contains__(self, key):
+        return key in self._models
+
+    def __len__(self):
+        return len(self._models)
+
+
+registry = ModelRegistry(settings.CLASSIFIER_MODELS_MEMORY_BUDGET * 1024 * 1024)
+
+
+def model_key(classifier):
+    """The script modification time is part of the key, so that an updated classifier script reloads its model"""
+    try:
+        return f'{classifier.path}:{os.path.getmtime(classifier.path)}'
+    except OSError:
+        return classifier.path
+
+
+def plugin_version(plugin, plugin_script):
+    """
+    Version of a plugin's model, stored with its results: the script's MODEL_VERSION (or VERSION) attribute if defined,
+    otherwise a hash of the script file, so that changing the script invalidates the previous results
+    """
+    version = getattr(plugin_script, 'MODEL_VERSION', None) or getattr(plugin_script, 'VERSION', None)
+    if version is not None:
+        return str(version)[:64]
+    try:
+        with open(plugin.path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()[:12]
+    except OSError:
+        return ''
+
+
+def has_model_contract(classifier_script):
+    return hasattr(classifier_script, 'load') and hasattr(classifier_script, 'predict')
+
+
+def get_predictor(classifier, classifier_script):
+    """
+    Returns a function that classifies a single file path.
+    Classifiers implementing the optional load()/predict(model, file_path) contract keep their model resident in the registry. Otherwise main(file_path) is used.
+    """
+    if has_model_contract(classifier_script):
+        model = registry.get(model_key(classifier), classifier_script.load)
+        return lambda file_path: classifier_script.predict(model, file_path)
+    return classifier_script.main
+
+
+def get_batch_predictor(classifier, classifier_script):
+    """
+    Returns a (classify_batch, prepare) pair, or None if the classifier doesn't support batches.
+    classify_batch receives a list with the result of prepare(file_path) for each object, and returns a list of results in the same order.
+    Classifiers with the load()/predict() contract can implement predict_batch(model, inputs), optionally with preprocess(file_path) to decode each input. Otherwise main_batch(file_paths) is used.
+    """
+    if has_model_contract(classifier_script) and hasattr(classifier_script, 'predict_batch'):
+        model = registry.get(model_key(classifier), classifier_script.load)
+        prepare = getattr(classifier_script, 'preprocess', lambda file_path: file_path)
+        return lambda inputs: classifier_script.predict_batch(model, inputs), prepare
+    if hasattr(classifier_script, 'main_batch'):
+        return classifier_script.main_batch, lambda file_path: file_path
+    return None
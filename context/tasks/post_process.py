@@ -1,10 +1,18 @@
-import importlib.util
 from context.models import SearchContext, Configuration, PostProcessor
-from context.tasks.helpers import change_status, write_log
+from context.tasks.executor import load_plugin, run_plugin, timed
+from context.tasks.fanout import id_ranges, run_stage
+from context.tasks.helpers import buffered_log, change_status, write_log, BulkUpdater
+from context.tasks.model_registry import plugin_version
 from maestro.celery import app
 
 
+def post_process_chunk(post_processor_script, file_paths):
+    """Runs in the stage executor processes"""
+    return [timed(post_processor_script.main, file_path) for file_path in file_paths]
+
+
 @app.task(bind=True)
+@buffered_log('post_process')
 def run_post_processors(self, gather_result, context_id):
     stage = 'post_process'
     context = SearchContext.objects.get(id=context_id)
@@ -35,46 +43,82 @@ def run_post_processors(self, gather_result, context_id):
 
     change_status(SearchContext.POST_PROCESSING, context, stage, f'Will use the post-processors: {post_processors}', True)
 
+    return run_stage(self, post_process_objects, finish_post_processing, id_ranges(datastream), context_id)
+
+
+@app.task(bind=True)
+@buffered_log('post_process')
+def post_process_objects(self, first_id, last_id, context_id):
+    """Runs the post-processors on the data objects with ids between first_id and last_id. Returns the number of results"""
+    stage = 'post_process'
+    context = SearchContext.objects.get(id=context_id)
+
+    if context.is_stopped:
+        return 0
+
+    datastream = context.datastream.in_id_range(first_id, last_id)
+    post_processors = context.configuration.advanced_configuration.post_processors.filter(is_active=True)
     post_processed_count = 0
     for post_processor in post_processors:
-        write_log(context, stage, f'Using post-processor \'{post_processor}\'')
+        write_log(context, stage, f'Using post-processor \'{post_processor}\' on objects {first_id} to {last_id}')
         if post_processor.type == PostProcessor.PYTHON_SCRIPT:
-            spec = importlib.util.spec_from_file_location(post_processor.name, post_processor.path)
-            post_processor_script = importlib.util.module_from_spec(spec)
-            spec.loader.exec_module(post_processor_script)
-
-            datastream_size = datastream.count()
+            # Objects processed by this version of the post-processor in previous iterations are skipped
+            try:
+                version = plugin_version(post_processor, load_plugin(post_processor.name, post_processor.path))
+            except Exception as ex:
+                write_log(context, stage, f'[ERROR] Post-processor {post_processor} failed to load. Skipping it')
+                print(f"Post-processor {post_processor} failed to load:\n{ex}")
+                continue
+            pending = datastream.not_seen_by(stage, post_processor, version)
+            already_processed = datastream.count() - pending.count()
+            if already_processed > 0:
+                write_log(context, stage, f'{already_processed} objects were already post-processed by \'{post_processor}\' (version {version})')
+            updated_field = 'metadata' if post_processor.kind == PostProcessor.METADATA_RETRIEVAL else 'data'
+            updater = BulkUpdater(datastream.model, [updated_field, 'identifier', 'stage_watermarks'])
             failures = 0
             failure_tolerance = 10  # if more than 10 failures occur, probably this post-processor is not doing something right
-            for index, data in enumerate(datastream):
+            outcomes = run_plugin('post_process', post_processor, pending, lambda data: data.data, post_process_chunk)
+            for data, (result, error, duration) in outcomes:
                 if failures > failure_tolerance:
                     write_log(context, stage, f'[ERROR] Post-processor {post_processor} raised too many exceptions. Aborting its execution')
                     break
 
-                try:
-                    write_log(context, stage, f'Post-processing {data.identifier} ({index+1}/{datastream_size})')
-                    result = post_processor_script.main(data.data)
-                    write_log(context, stage, f'Post-processing {data.identifier} result: {result}')
-                    if result is not None:
-                        post_processed_count += 1
-                        write_log(context, stage, f'Saving post-processing of {data.identifier} result')
-                        if post_processor.kind == PostProcessor.DATA_MANIPULATION:
-                            if post_processor.data_type == Configuration.IMAGES:
-                                # TODO: Not needed yet! Use functions in utils/image. What is the input? PIL object?
-                                pass
-                            else:
-                                data.data = result
-                        elif post_processor.kind == PostProcessor.METADATA_RETRIEVAL:
-                            data.metadata = result
-                        data.save()
-                        write_log(context, stage, f'Saved post-processing of {data.identifier} result')
-                except Exception as ex:
+                if error is not None:
                     # Post processors shouldn't return exceptions, but it's safer to catch if one occurs
                     failures += 1
-                    write_log(context, stage, f'[ERROR] Post-processor failed on {data.identifier}. Continuing...')
-                    print(f"Post-processor {post_processor} failed:\n{ex}")
+                    write_log(context, stage, f'[ERROR] Post-processor failed on {data.identifier}. Continuing...', obj=data.identifier)
+                    print(f"Post-processor {post_processor} failed:\n{error}")
+                    continue
+
+                if result is not None:
+                    post_processed_count += 1
+                    if post_processor.kind == PostProcessor.DATA_MANIPULATION:
+                        if post_processor.data_type == Configuration.IMAGES:
+                            # TODO: Not needed yet! Use functions in utils/image. What is the input? PIL object?
+                            pass
+                        else:
+                            data.data = result
+                            data.refresh_identifier()
+                    elif post_processor.kind == PostProcessor.METADATA_RETRIEVAL:
+                        data.metadata = result
+                data.mark_seen(stage, post_processor, version)
+                updater.add(data)
+                write_log(context, stage, f'Post-processing {data.identifier} result: {result}', obj=data.identifier, duration=duration)
+            outcomes.close()
+            updater.flush()
+    return post_processed_count
+
+
+@app.task(bind=True)
+@buffered_log('post_process')
+def finish_post_processing(self, post_processed_counts, context_id):
+    stage = 'post_process'
+    context = SearchContext.objects.get(id=context_id)
+
+    if context.is_stopped:
+        return False
 
     change_status(SearchContext.FINISHED_POST_PROCESSING, context, stage, 'Finished post-processing')
-    write_log(context, stage, f'Post-processed {post_processed_count} in {len(datastream)} objects')
+    write_log(context, stage, f'Post-processed {sum(post_processed_counts)} in {context.datastream.count()} objects')
     write_log(context, stage, f'Following stage is filtering')
     return True
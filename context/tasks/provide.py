@@ -1,31 +1,143 @@
-from context.models import SearchContext
-from context.tasks.helpers import change_status, write_log
+import gzip
+import hashlib
+import json
+from datetime import timedelta
+from celery import chord
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from context.models import SearchContext, AdvancedConfiguration, ClassificationResult, ProviderBatch
+from context.tasks.helpers import buffered_log, change_status, write_log
 from maestro.celery import app
 import requests
 from django.core.mail import EmailMessage
 
 
-def generate_json(classifiers, datastream, keep_null=True):
-    json_data = {}
+def classification_results(classifiers, datastream):
+    """Latest result of each classifier on each object of the datastream, by (classifier id, object id), fetched with a single query"""
+    rows = ClassificationResult.objects.filter(
+        classifier__in=classifiers,
+        content_type=ContentType.objects.get_for_model(datastream.model),
+        object_id__in=datastream.values('pk')
+    ).order_by('id').values_list('classifier_id', 'object_id', 'result')
+    return {(classifier_id, object_id): result for classifier_id, object_id, result in rows}
+
+
+def result_entries(classifiers, objects, results, keep_null=True):
+    """Yields a (classifier name, entry) pair for each result to send. results is returned by classification_results"""
     for classifier in classifiers:
-        classifier_name = classifier.name
-        json_data[classifier_name] = {}
-        data_object_list = []
-        for data in datastream:
-            classification_result = data.classification_result
-            if keep_null or (not keep_null and classification_result[classifier_name] is not None):
-                json_data_object = {
+        for data in objects:
+            result = results.get((classifier.id, data.id), None)
+            if keep_null or (not keep_null and result is not None):
+                yield classifier.name, {
                     'name': data.identifier,
                     'preview_url': f'http://{data.thumb_url}',
-                    'result': classification_result[classifier_name],
+                    'result': result,
                     'datetime': data.metadata.get('datetime', '') if data.metadata else ''
                 }
-                data_object_list.append(json_data_object)
-        json_data[classifier_name] = data_object_list
 
+
+def generate_json(classifiers, datastream, keep_null=True):
+    results = classification_results(classifiers, datastream)
+    json_data = {classifier.name: [] for classifier in classifiers}
+    for classifier_name, entry in result_entries(classifiers, datastream, results, keep_null):
+        json_data[classifier_name].append(entry)
     return json_data
 
 
+def id_batches(ids, batch_size):
+    for i in range(0, len(ids), batch_size):
+        yield ids[i:i + batch_size]
+
+
+def encode_batch(webhook_format, classifiers, objects, keep_null=True):
+    """
+    Serializes the results of the objects. Returns the body and its headers.
+    JSON batches have the same format as the JSON sent in one request. NDJSON batches have a line per result, with the classifier name in it. Batches are compressed with gzip
+    """
+    results = classification_results(classifiers, objects)
+    entries = result_entries(classifiers, objects, results, keep_null)
+    if webhook_format == AdvancedConfiguration.NDJSON_BATCHES:
+        content_type = 'application/x-ndjson'
+        body = ''.join(json.dumps({'classifier': classifier_name, **entry}, cls=DjangoJSONEncoder) + '\n' for classifier_name, entry in entries)
+    else:
+        content_type = 'application/json'
+        json_data = {classifier.name: [] for classifier in classifiers}
+        for classifier_name, entry in entries:
+            json_data[classifier_name].append(entry)
+        body = json.dumps(json_data, cls=DjangoJSONEncoder)
+
+    if webhook_format == AdvancedConfiguration.JSON:
+        return body.encode('utf-8'), {'Content-Type': content_type}
+    return gzip.compress(body.encode('utf-8')), {'Content-Type': content_type, 'Content-Encoding': 'gzip'}
+
+
+def idempotency_key(context, batch_ids):
+    """Identifies a batch: the same objects of the same iteration always have the same key, so receivers can ignore repeated deliveries"""
+    batch = f'{context.id}:{context.number_of_iterations}:{",".join(str(id) for id in batch_ids)}'
+    return hashlib.sha256(batch.encode('utf-8')).hexdigest()
+
+
+def post_batch(webhook, body, headers, key, number, total):
+    """Sends a batch. Raises a requests exception if it wasn't delivered"""
+    headers = {**headers, 'Idempotency-Key': key, 'X-Maestro-Batch': f'{number}/{total}'}
+    response = requests.post(webhook, data=body, headers=headers, timeout=settings.PROVIDER_TIMEOUT)
+    response.raise_for_status()
+
+
+def describe_error(ex):
+    if isinstance(ex, requests.exceptions.ConnectionError):
+        return 'A network problem occurred while requesting'
+    elif isinstance(ex, requests.exceptions.HTTPError):
+        return f'Received a response with status code {ex.response.status_code}'
+    elif isinstance(ex, requests.exceptions.Timeout):
+        return 'Request to the remote server timed out'
+    elif isinstance(ex, requests.exceptions.TooManyRedirects):
+        return 'Request exceeded the maximum number of redirects'
+    return f'{type(ex).__name__}: {ex}'
+
+
+def is_transient(ex):
+    """Whether the delivery may succeed if retried. Client errors (4xx) are not retried, except timeouts and rate limits"""
+    if isinstance(ex, requests.exceptions.HTTPError) and ex.response is not None:
+        return ex.response.status_code >= 500 or ex.response.status_code in (408, 429)
+    return not isinstance(ex, requests.exceptions.TooManyRedirects)
+
+
+def retry_countdown(attempts):
+    """Seconds until the next attempt of a batch (exponential backoff)"""
+    return settings.PROVIDER_RETRY_BACKOFF * 2 ** (attempts - 1)
+
+
+def create_batches(context, advanced_configuration, object_ids):
+    """
+    Splits the objects in the batches to deliver. Objects in a batch of a previous run that wasn't delivered are left out: retrying batches are
+    still being delivered, and dead ones are kept until they are replayed. Pending batches (e.g.: of an interrupted run) are delivered again
+    """
+    undelivered = ProviderBatch.objects.filter(context=context).exclude(status=ProviderBatch.DELIVERED)
+    batched_ids = {object_id for batch_ids in undelivered.values_list('object_ids', flat=True) for object_id in batch_ids}
+    object_ids = [object_id for object_id in object_ids if object_id not in batched_ids]
+    pending = list(undelivered.filter(status=ProviderBatch.PENDING))
+    if len(object_ids) == 0:
+        return pending
+
+    webhook_format = advanced_configuration.webhook_format
+    batch_size = len(object_ids) if webhook_format == AdvancedConfiguration.JSON else settings.PROVIDER_BATCH_SIZE
+    batches = list(id_batches(object_ids, batch_size))
+    return pending + ProviderBatch.objects.bulk_create([
+        ProviderBatch(
+            context=context,
+            key=idempotency_key(context, batch_ids),
+            number=number,
+            total=len(batches),
+            webhook_format=webhook_format,
+            object_ids=batch_ids
+        )
+        for number, batch_ids in enumerate(batches, start=1)
+    ])
+
+
 def send_notification_email(context):
     mail_subject = 'Search context finished'
     message = f'Hello. The search context \'{context.name}\' you created in Maestro has finished. The data has been sent to the remote server specified in the webhook configuration field. If you want to inspect this data manually, head to the Search Context details page and click \'Download results\''
@@ -34,6 +146,7 @@ def send_notification_email(context):
 
 
 @app.task(bind=True)
+@buffered_log('provide')
 def run_provider(self, classification_result, context_id):
     stage = 'provide'
     context = SearchContext.objects.get(id=context_id)
@@ -44,39 +157,120 @@ def run_provider(self, classification_result, context_id):
     if classification_result is not True:  # something went wrong on the classification stage
         return False
 
-    datastream = context.datastream.filter(filtered=False)
+    datastream = context.datastream.unfiltered()
     advanced_configuration = context.configuration.advanced_configuration
 
     if advanced_configuration is None or (advanced_configuration is not None and advanced_configuration.webhook is None):
         change_status(SearchContext.FINISHED_PROVIDING, context, stage, 'No providers used. You can either provide a webhook and rerun, or download the results directly from the download button.', True)
         return True
 
-    if advanced_configuration.minimum_objects is not None and datastream.count() < advanced_configuration.minimum_objects:
-        change_status(SearchContext.FINISHED_PROVIDING, context, stage, f'The number of gathered objects was {datastream.count()}, but according to this search context configuration {advanced_configuration.minimum_objects} are required to send the data to the webhook.', True)
+    datastream_size = datastream.count() if advanced_configuration.minimum_objects is not None else None
+    if advanced_configuration.minimum_objects is not None and datastream_size < advanced_configuration.minimum_objects:
+        change_status(SearchContext.FINISHED_PROVIDING, context, stage, f'The number of gathered objects was {datastream_size}, but according to this search context configuration {advanced_configuration.minimum_objects} are required to send the data to the webhook.', True)
         return True
 
     webhook = advanced_configuration.webhook
     change_status(SearchContext.PROVIDING, context, stage, f'Will send the data to {webhook}', True)
 
-    classifiers = advanced_configuration.classifiers.filter(is_active=True)
+    # Only the objects with results not sent yet (new objects or new classifications since the previous iteration)
+    new_objects = datastream.not_provided()
+    new_ids = list(new_objects.ids())
+    if len(new_ids) == 0:
+        change_status(SearchContext.FINISHED_PROVIDING, context, stage, 'No new results since the previous iteration. Nothing was sent')
+        return True
+    write_log(context, stage, f'{len(new_ids)} objects have new results')
+
+    batches = create_batches(context, advanced_configuration, new_ids)
+    if len(batches) == 0:
+        dead = ProviderBatch.objects.filter(context=context, status=ProviderBatch.DEAD).count()
+        if dead > 0:
+            change_status(SearchContext.FAILED_PROVIDING, context, stage, f'[ERROR] The new results are in {dead} batches that could not be delivered. They can be replayed from the administration')
+            return False
+        change_status(SearchContext.FINISHED_PROVIDING, context, stage, 'The new results are in batches of a previous run, which are still being retried')
+        return True
+    write_log(context, stage, f'Sending {len(batches)} batches...' if len(batches) > 1 else 'Sending request...')
+    raise self.replace(chord([deliver_batch.s(batch.id, context_id) for batch in batches], finish_providing.s(context_id)))
 
-    json_data = generate_json(classifiers, datastream, advanced_configuration.keep_null)
 
-    write_log(context, stage, f'Sending request...')
+@app.task(bind=True, max_retries=None)
+@buffered_log('provide')
+def deliver_batch(self, batch_id, context_id):
+    """
+    Delivers a batch to the webhook. Failed deliveries are retried with exponential backoff, up to settings.PROVIDER_BATCH_RETRIES times.
+    Then, the batch is dead and can be replayed from the administration. Returns whether the batch was delivered
+    """
+    stage = 'provide'
     try:
-        response = requests.post(webhook, json=json_data, timeout=10)
-        response.raise_for_status()
-    except requests.exceptions.ConnectionError:
-        change_status(SearchContext.FAILED_PROVIDING, context, stage, f'[ERROR] A network problem occurred while requesting')
-        return False
-    except requests.exceptions.HTTPError:
-        change_status(SearchContext.FAILED_PROVIDING, context, stage, f'[ERROR] Received a response with status code different than 200')
+        batch = ProviderBatch.objects.select_related('context').get(id=batch_id)
+    except ProviderBatch.DoesNotExist:  # e.g.: the context was deleted
+        print(f'Batch {batch_id} of context {context_id} no longer exists')
         return False
-    except requests.exceptions.Timeout:
-        change_status(SearchContext.FAILED_PROVIDING, context, stage, f'[ERROR] Request to the remote server timed out')
-        return False
-    except requests.exceptions.TooManyRedirects:
-        change_status(SearchContext.FAILED_PROVIDING, context, stage, f'[ERROR] Request exceeded the maximum number of redirects')
+    if batch.status == ProviderBatch.DELIVERED:
+        return True
+
+    context = batch.context
+    batch.attempts += 1
+    try:
+        advanced_configuration = context.configuration.advanced_configuration
+        classifiers = list(advanced_configuration.classifiers.filter(is_active=True))
+        objects = context.datastream.filter(id__in=batch.object_ids).order_by('id').for_results()
+        body, headers = encode_batch(batch.webhook_format, classifiers, objects, advanced_configuration.keep_null)
+        post_batch(advanced_configuration.webhook, body, headers, batch.key, batch.number, batch.total)
+    except Exception as ex:  # not only delivery errors (e.g.: database errors). The failure is always recorded, so the chord reaches finish_providing
+        response = ex.response if isinstance(ex, requests.exceptions.RequestException) else None
+        batch.last_status = response.status_code if response is not None else None
+        batch.last_error = describe_error(ex)
+        if batch.attempts > settings.PROVIDER_BATCH_RETRIES or not is_transient(ex):
+            batch.status = ProviderBatch.DEAD
+            batch.next_retry_at = None
+            batch.save()
+            write_log(context, stage, f'[ERROR] Batch {batch.number}/{batch.total} failed after {batch.attempts} attempts: {batch.last_error}')
+            return False
+
+        countdown = retry_countdown(batch.attempts)
+        batch.status = ProviderBatch.RETRYING
+        batch.next_retry_at = timezone.now() + timedelta(seconds=countdown)
+        batch.save()
+        write_log(context, stage, f'Batch {batch.number}/{batch.total} failed ({batch.last_error}). Retrying in {countdown} seconds')
+        raise self.retry(countdown=countdown, exc=ex)
+
+    batch.status = ProviderBatch.DELIVERED
+    batch.last_status = 200
+    batch.last_error = ''
+    batch.next_retry_at = None
+    batch.delivered_at = timezone.now()
+    batch.save()
+    objects.update(provided_at=batch.delivered_at)
+    write_log(context, stage, f'Batch {batch.number}/{batch.total} delivered ({len(body)} bytes)')
+
+    # Replayed dead letters complete the providing stage once every batch is delivered
+    if context.status == SearchContext.FAILED_PROVIDING and not ProviderBatch.objects.filter(context=context).exclude(status=ProviderBatch.DELIVERED).exists():
+        change_status(SearchContext.FINISHED_PROVIDING, context, stage, 'Every batch was delivered after being replayed')
+    return True
+
+
+def replay_batches(batches):
+    """Delivers the batches again (e.g.: dead letters, after the receiver is fixed). Returns the number of batches replayed"""
+    replayed = 0
+    for batch in batches.exclude(status=ProviderBatch.DELIVERED):
+        batch.status = ProviderBatch.PENDING
+        batch.attempts = 0
+        batch.next_retry_at = None
+        batch.save()
+        deliver_batch.delay(batch.id, batch.context_id)
+        replayed += 1
+    return replayed
+
+
+@app.task(bind=True)
+@buffered_log('provide')
+def finish_providing(self, delivered, context_id):
+    stage = 'provide'
+    context = SearchContext.objects.get(id=context_id)
+
+    failed = delivered.count(False)
+    if failed > 0:
+        change_status(SearchContext.FAILED_PROVIDING, context, stage, f'[ERROR] {failed} out of {len(delivered)} batches could not be delivered. They can be replayed from the administration')
         return False
 
     change_status(SearchContext.FINISHED_PROVIDING, context, stage, 'The remote server responded with status 200')
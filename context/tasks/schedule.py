@@ -0,0 +1,92 @@
+"""
+Scheduling of the iterations of repeated contexts (configuration.repeat_amount and repeat_unit).
+When an iteration finishes, the context waits with next_run_at set (see signals.py). schedule_iterations runs every settings.SCHEDULER_TICK seconds
+(with celery beat), and starts the due contexts, respecting a maximum of contexts running at once per owner. Starts are spread with a random delay.
+"""
+import random
+from datetime import timedelta
+from celery import chain
+from django.conf import settings
+from django.db.models import Count, Q
+from django.utils import timezone
+from context.models import SearchContext
+from context.tasks.fetch import run_fetchers
+from context.tasks.gather import run_default_gatherer
+from context.tasks.post_process import run_post_processors
+from context.tasks.filter import run_filters
+from context.tasks.classify import run_classifiers
+from context.tasks.provide import run_provider
+from maestro.celery import app
+
+REPEAT_UNIT_SECONDS = {
+    'MIN': 60,
+    'HOUR': 60 * 60,
+    'DAY': 60 * 60 * 24,
+}
+
+# Statuses of the contexts being executed
+RUNNING_STATUSES = [
+    SearchContext.FETCHING_URLS,
+    SearchContext.FINISHED_FETCHING_URLS,
+    SearchContext.GATHERING_DATA,
+    SearchContext.FINISHED_GATHERING_DATA,
+    SearchContext.POST_PROCESSING,
+    SearchContext.FINISHED_POST_PROCESSING,
+    SearchContext.FILTERING,
+    SearchContext.FINISHED_FILTERING,
+    SearchContext.CLASSIFYING,
+    SearchContext.FINISHED_CLASSIFYING,
+    SearchContext.PROVIDING,
+]
+
+
+def repeat_interval(configuration):
+    """Time between iterations, or None if the context isn't repeated"""
+    if configuration is None or configuration.repeat_amount is None or configuration.repeat_unit is None:
+        return None
+    return timedelta(seconds=configuration.repeat_amount * REPEAT_UNIT_SECONDS.get(configuration.repeat_unit, 1))
+
+
+def iteration_chain(context_id):
+    return chain(
+        run_fetchers.s(context_id),
+        run_default_gatherer.s(context_id),
+        run_post_processors.s(context_id),
+        run_filters.s(context_id),
+        run_classifiers.s(context_id),
+        run_provider.s(context_id)
+    )
+
+
+def running_per_owner():
+    """Number of running contexts of each (owner type id, owner id). Includes the ones started by the scheduler that are waiting for their delay"""
+    starting = Q(status=SearchContext.WAITING_ITERATION, next_run_at__isnull=True)
+    rows = SearchContext.objects.filter(Q(status__in=RUNNING_STATUSES) | starting, is_stopped=False).values('owner_type_id', 'owner_id').annotate(running=Count('id'))
+    return {(row['owner_type_id'], row['owner_id']): row['running'] for row in rows}
+
+
+@app.task
+def schedule_iterations():
+    """Starts the contexts whose next iteration is due. Returns the number of contexts started"""
+    due = SearchContext.objects.filter(
+        next_run_at__lte=timezone.now(),
+        status=SearchContext.WAITING_ITERATION,
+        is_stopped=False
+    ).order_by('next_run_at').only('id', 'next_run_at', 'owner_type_id', 'owner_id')[:settings.SCHEDULER_BATCH_SIZE]
+
+    running = running_per_owner()
+    started = 0
+    for context in due:
+        owner = (context.owner_type_id, context.owner_id)
+        if running.get(owner, 0) >= settings.SCHEDULER_MAX_RUNNING_PER_OWNER:
+            continue  # stays due, and is started in a following tick
+
+        # Claims the iteration, so a context is only started once even if ticks overlap
+        claimed = SearchContext.objects.filter(id=context.id, next_run_at=context.next_run_at).update(next_run_at=None)
+        if not claimed:
+            continue
+
+        iteration_chain(context.id).apply_async(countdown=random.uniform(0, settings.SCHEDULER_JITTER))
+        running[owner] = running.get(owner, 0) + 1
+        started += 1
+    return started
@@ -3,3 +3,18 @@ from .context_configure import *
 from .context_list import *
 from .configuration_list import *
 from .context_delete import *
+from .model_registry import *
+from .batches import *
+from .fetch import *
+from .ingest import *
+from .gather import *
+from .stage_log import *
+from .bulk_update import *
+from .executor import *
+from .fanout import *
+from .incremental import *
+from .schedule import *
+from .provide import *
+from .export import *
+from .datastream import *
+from .classification_results import *
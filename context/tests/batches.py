@@ -0,0 +1,24 @@
+from django.test import SimpleTestCase
+from context.tasks.helpers import prefetched_batches
+
+
+class PrefetchedBatchesTests(SimpleTestCase):
+    def test_batches_keep_order(self):
+        batches = list(prefetched_batches(list(range(7)), 3, lambda item: item * 2))
+        self.assertEqual([batch for batch, _ in batches], [[0, 1, 2], [3, 4, 5], [6]])
+        self.assertEqual([value for _, prepared in batches for value, _ in prepared], [0, 2, 4, 6, 8, 10, 12])
+
+    def test_prepare_failure_is_reported_per_item(self):
+        def prepare(item):
+            if item == 1:
+                raise ValueError('corrupted file')
+            return item
+
+        (batch, prepared), = prefetched_batches([0, 1, 2], 3, prepare)
+        self.assertIsNone(prepared[0][1])
+        self.assertIsInstance(prepared[1][1], ValueError)
+        self.assertEqual(prepared[2], (2, None))
+
+    def test_stop_early(self):
+        for batch, _ in prefetched_batches(list(range(100)), 1, lambda item: item):
+            break
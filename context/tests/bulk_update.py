@@ -0,0 +1,31 @@
+from types import SimpleNamespace
+from django.test import SimpleTestCase
+from context.tasks.helpers import BulkUpdater
+
+
+class RecordingManager:
+    def __init__(self):
+        self.calls = []
+
+    def bulk_update(self, objs, fields, batch_size=None):
+        self.calls.append(([obj.id for obj in objs], fields))
+
+
+class BulkUpdaterTests(SimpleTestCase):
+    def test_updates_in_chunks_of_changed_fields(self):
+        model = SimpleNamespace(objects=RecordingManager())
+        updater = BulkUpdater(model, ['filtered'], commit_interval=2)
+        for i in range(5):
+            updater.add(SimpleNamespace(id=i))
+        self.assertEqual(model.objects.calls, [([0, 1], ['filtered']), ([2, 3], ['filtered'])])
+
+        updater.flush()
+        updater.flush()
+        self.assertEqual(model.objects.calls[-1], ([4], ['filtered']))
+        self.assertEqual(len(model.objects.calls), 3)
+
+    def test_context_manager_flushes(self):
+        model = SimpleNamespace(objects=RecordingManager())
+        with BulkUpdater(model, ['metadata'], commit_interval=10) as updater:
+            updater.add(SimpleNamespace(id=1))
+        self.assertEqual(model.objects.calls, [([1], ['metadata'])])
@@ -0,0 +1,62 @@
+from io import StringIO
+from django.core.management import call_command
+from context.models import ImageData, Classifier, ClassificationResult
+from context.tasks.classify import unclassified, ResultsWriter
+from context.tests.tests_setup import ContextTestCase
+
+
+class ClassificationResultsTest(ContextTestCase):
+    def setUp(self):
+        super().setUp()
+        self.classifier = Classifier.objects.create(name='Birds', type=Classifier.PYTHON_SCRIPT, data_type='IMAGES', path='birds.py', return_type='STR')
+        self.other_classifier = Classifier.objects.create(name='Trees', type=Classifier.PYTHON_SCRIPT, data_type='IMAGES', path='trees.py', return_type='STR')
+        self.objects = [
+            ImageData.objects.create(context=self.context, data=f'/data/{i}.jpg', data_thumb=f'/thumbs/{i}.jpg', data_thumb_static=f'/static/{i}.jpg')
+            for i in range(3)
+        ]
+
+    def add_results(self, classifier, model_version, objects, result='bird'):
+        with ResultsWriter(self.context, classifier, model_version, ImageData) as results_writer:
+            for data in objects:
+                results_writer.add_result(data, result)
+
+    def test_unclassified(self):
+        datastream = ImageData.objects.filter(context=self.context)
+        self.add_results(self.classifier, '1', self.objects[:2])
+        self.add_results(self.other_classifier, '1', self.objects[2:])
+
+        self.assertEqual(list(unclassified(datastream, self.classifier, '1').order_by('id')), self.objects[2:])
+        self.assertEqual(list(unclassified(datastream, self.classifier, '2').order_by('id')), self.objects)
+        self.assertEqual(list(unclassified(datastream, self.other_classifier, '1').order_by('id')), self.objects[:2])
+
+    def test_results_are_created_once(self):
+        self.add_results(self.classifier, '1', self.objects)
+        self.add_results(self.classifier, '1', self.objects, result='other')
+        self.assertEqual(ClassificationResult.objects.filter(classifier=self.classifier).count(), 3)
+
+    def test_classifications(self):
+        self.add_results(self.classifier, '1', self.objects[:1], result='sparrow')
+        self.add_results(self.classifier, '2', self.objects[:1], result='robin')
+        self.add_results(self.other_classifier, '1', self.objects[:1], result='oak')
+
+        data = ImageData.objects.filter(id=self.objects[0].id).with_classification_results().get()
+        self.assertEqual(data.classifications, {'Birds': 'robin', 'Trees': 'oak'})
+        self.assertIsNone(ImageData.objects.with_classification_results().get(id=self.objects[1].id).classifications)
+
+    def test_results_are_deleted_with_the_object(self):
+        self.add_results(self.classifier, '1', self.objects)
+        self.objects[0].delete()
+        self.assertEqual(ClassificationResult.objects.count(), 2)
+
+    def test_backfill_classification_results(self):
+        ImageData.objects.filter(id=self.objects[0].id).update(classification_result={'Birds': 'sparrow', 'Trees': 'oak'})
+        ImageData.objects.filter(id=self.objects[1].id).update(classification_result={'Unknown': 1})
+
+        call_command('backfill_classification_results', stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(self.objects[0].classification_results.get(classifier=self.classifier).model_version, 'legacy')
+        self.assertEqual(ImageData.objects.get(id=self.objects[0].id).classifications, {'Birds': 'sparrow', 'Trees': 'oak'})
+        self.assertIsNone(ImageData.objects.get(id=self.objects[0].id).classification_result)
+        self.assertEqual(ImageData.objects.get(id=self.objects[1].id).classification_result, {'Unknown': 1})
+
+        call_command('backfill_classification_results', stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(ClassificationResult.objects.count(), 2)
@@ -0,0 +1,19 @@
+from django.test import SimpleTestCase
+from context.models import SearchContext, Configuration, ImageData, SoundData
+
+
+class DatastreamTests(SimpleTestCase):
+    def test_model_is_given_by_the_data_type(self):
+        self.assertIs(SearchContext(configuration=Configuration(data_type=Configuration.IMAGES)).data_model, ImageData)
+        self.assertIs(SearchContext(configuration=Configuration(data_type=Configuration.SOUNDS)).data_model, SoundData)
+
+    def test_not_configured(self):
+        context = SearchContext()
+        self.assertIsNone(context.data_model)
+        self.assertIsNone(context.datastream)
+
+    def test_results_columns(self):
+        for model in (ImageData, SoundData):
+            fields, defer = model.objects.for_results().query.deferred_loading
+            self.assertFalse(defer)
+            self.assertEqual(fields, {'id', 'identifier', 'metadata', model.static_field})
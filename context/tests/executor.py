@@ -0,0 +1,89 @@
+import os
+import tempfile
+from types import SimpleNamespace
+from unittest import mock
+import billiard
+from django.test import SimpleTestCase, override_settings
+from context.tasks.executor import run_plugin, timed
+
+PLUGIN = '''
+import os
+
+def main(value):
+    if value < 0:
+        raise ValueError('negative value')
+    return value * 2, os.getpid()
+'''
+
+
+def double_chunk(script, values, offset):
+    return [timed(script.main, value + offset) for value in values]
+
+
+def run_in_worker(plugin, objects):
+    """Runs the plugin like a stage task in a celery prefork worker (a daemonic process)"""
+    outcomes = list(run_plugin('filter', plugin, objects, lambda obj: obj.value, double_chunk, (1,)))
+    return outcomes, os.getpid()
+
+
+@override_settings(STAGE_CHUNK_SIZE=3)
+class RunPluginTests(SimpleTestCase):
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        path = os.path.join(folder.name, 'plugin.py')
+        with open(path, 'w') as f:
+            f.write(PLUGIN)
+        self.plugin = SimpleNamespace(name='plugin', path=path)
+        self.objects = [SimpleNamespace(value=value) for value in [1, 2, -10, 3, 4, 5, 6]]
+
+    def run_plugin(self):
+        return list(run_plugin('filter', self.plugin, self.objects, lambda obj: obj.value, double_chunk, (1,)))
+
+    def check_outcomes(self, outcomes):
+        self.assertEqual([obj for obj, _ in outcomes], self.objects)
+        results = [result[0] if result else None for _, (result, _, _) in outcomes]
+        self.assertEqual(results, [4, 6, None, 8, 10, 12, 14])
+        errors = [error for _, (_, error, _) in outcomes]
+        self.assertEqual(errors[2], 'ValueError: negative value')
+        self.assertEqual(errors.count(None), 6)
+
+    @override_settings(STAGE_PROCESSES={'filter': 1})
+    def test_in_process(self):
+        outcomes = self.run_plugin()
+        self.check_outcomes(outcomes)
+        self.assertEqual({result[1] for _, (result, _, _) in outcomes if result}, {os.getpid()})
+
+    @override_settings(STAGE_PROCESSES={'filter': 2})
+    def test_process_pool(self):
+        outcomes = self.run_plugin()
+        self.check_outcomes(outcomes)
+        self.assertNotIn(os.getpid(), {result[1] for _, (result, _, _) in outcomes if result})
+
+    @override_settings(STAGE_PROCESSES={'filter': 2})
+    def test_stop_early(self):
+        outcomes = run_plugin('filter', self.plugin, self.objects, lambda obj: obj.value, double_chunk, (1,))
+        next(outcomes)
+        outcomes.close()
+
+    @override_settings(STAGE_PROCESSES={'filter': 1})
+    def test_plugin_that_fails_to_load(self):
+        with open(self.plugin.path, 'w') as f:
+            f.write('raise ImportError("missing dependency")\n')
+        outcomes = self.run_plugin()
+        self.assertTrue(all(error.startswith('Failed to load plugin') for _, (_, error, _) in outcomes))
+
+    @override_settings(STAGE_PROCESSES={'filter': 2})
+    def test_in_daemonic_worker(self):
+        worker = billiard.get_context('fork').Pool(1)
+        self.addCleanup(worker.terminate)
+        outcomes, worker_pid = worker.apply_async(run_in_worker, (self.plugin, self.objects)).get(timeout=60)
+        self.assertEqual([result[0] if result else None for _, (result, _, _) in outcomes], [4, 6, None, 8, 10, 12, 14])
+        self.assertNotIn(worker_pid, {result[1] for _, (result, _, _) in outcomes if result})
+
+    @override_settings(STAGE_PROCESSES={'filter': 2})
+    def test_pool_that_fails_to_start(self):
+        with mock.patch('context.tasks.executor.get_pool', side_effect=AssertionError('daemonic processes are not allowed to have children')):
+            outcomes = self.run_plugin()
+        self.check_outcomes(outcomes)
+        self.assertEqual({result[1] for _, (result, _, _) in outcomes if result}, {os.getpid()})
@@ -0,0 +1,72 @@
+import csv
+import io
+import json
+import os
+import tempfile
+from types import SimpleNamespace
+from unittest import mock
+from zipfile import ZipFile, ZIP_DEFLATED, ZIP_STORED
+from django.test import SimpleTestCase
+from context.export import stream_zip, stream_results
+
+
+class StreamZipTests(SimpleTestCase):
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.image = os.path.join(folder.name, 'image.jpg')
+        self.text = os.path.join(folder.name, 'notes.txt')
+        with open(self.image, 'wb') as f:
+            f.write(os.urandom(300 * 1024))
+        with open(self.text, 'w') as f:
+            f.write('maestro ' * 1000)
+        self.missing = os.path.join(folder.name, 'missing.jpg')
+
+    def test_archive(self):
+        chunks = list(stream_zip(iter([self.image, self.missing, self.text])))
+        self.assertGreater(len(chunks), 2)
+        self.assertTrue(all(chunks))
+
+        with ZipFile(io.BytesIO(b''.join(chunks))) as zip_file:
+            self.assertEqual(zip_file.namelist(), ['image.jpg', 'notes.txt'])
+            self.assertEqual(zip_file.getinfo('image.jpg').compress_type, ZIP_STORED)
+            self.assertEqual(zip_file.getinfo('notes.txt').compress_type, ZIP_DEFLATED)
+            with open(self.image, 'rb') as f:
+                self.assertEqual(zip_file.read('image.jpg'), f.read())
+            self.assertIsNone(zip_file.testzip())
+
+
+class StreamResultsTests(SimpleTestCase):
+    classifiers = [SimpleNamespace(name='animals'), SimpleNamespace(name='empty'), SimpleNamespace(name='colors')]
+    entries = {
+        'animals': [[{'name': 'a.jpg', 'preview_url': 'http://host/a.jpg', 'result': 'cat', 'datetime': ''}], [{'name': 'b.jpg', 'preview_url': 'http://host/b.jpg', 'result': None, 'datetime': '2022'}]],
+        'empty': [],
+        'colors': [[{'name': 'a.jpg', 'preview_url': 'http://host/a.jpg', 'result': {'red': 0.9}, 'datetime': ''}]],
+    }
+
+    def result_batches(self, classifiers, datastream, keep_null=True):
+        # Batches of (classifier name, entry) pairs, like the ones read from the database
+        for classifier in classifiers:
+            for batch in self.entries[classifier.name]:
+                yield [(classifier.name, entry) for entry in batch]
+
+    def stream(self, results_format):
+        with mock.patch('context.export.result_batches', self.result_batches):
+            return b''.join(stream_results(self.classifiers, None, results_format)).decode('utf-8')
+
+    def test_json_is_the_indented_document(self):
+        expected = {name: [entry for batch in batches for entry in batch] for name, batches in self.entries.items()}
+        self.assertEqual(self.stream('json'), json.dumps(expected, indent=4))
+
+    def test_ndjson(self):
+        lines = [json.loads(line) for line in self.stream('ndjson').splitlines()]
+        self.assertEqual([(line['classifier'], line['name']) for line in lines], [('animals', 'a.jpg'), ('animals', 'b.jpg'), ('colors', 'a.jpg')])
+
+    def test_csv(self):
+        rows = list(csv.reader(io.StringIO(self.stream('csv'))))
+        self.assertEqual(rows[0], ['classifier', 'name', 'preview_url', 'result', 'datetime'])
+        self.assertEqual(rows[1:], [
+            ['animals', 'a.jpg', 'http://host/a.jpg', 'cat', ''],
+            ['animals', 'b.jpg', 'http://host/b.jpg', '', '2022'],
+            ['colors', 'a.jpg', 'http://host/a.jpg', '{"red": 0.9}', ''],
+        ])
@@ -0,0 +1,19 @@
+from django.test import SimpleTestCase
+from context.tasks.fanout import split_ids, line_ranges
+
+
+class FanOutRangesTests(SimpleTestCase):
+    def test_split_ids(self):
+        self.assertEqual(split_ids([1, 2, 5, 7, 8, 20, 21], 3), [(1, 5), (7, 20), (21, 21)])
+
+    def test_split_ids_in_one_range_when_disabled(self):
+        self.assertEqual(split_ids([4, 9, 12], 0), [(4, 12)])
+
+    def test_split_no_ids(self):
+        self.assertEqual(split_ids([], 3), [])
+        self.assertEqual(split_ids([], 0), [])
+
+    def test_line_ranges(self):
+        self.assertEqual(line_ranges(7, 3), [(0, 3), (3, 6), (6, 7)])
+        self.assertEqual(line_ranges(7, 0), [(0, 7)])
+        self.assertEqual(line_ranges(0, 3), [])
@@ -0,0 +1,99 @@
+import os
+import tempfile
+from types import SimpleNamespace
+from django.test import SimpleTestCase
+from datetime import datetime
+from context.tasks.fetch import FetcherRun, cache_key, merge_urls
+from context.tasks.helpers import read_urls_file
+from fetchers.runtime import CappedRetry, RETRY_AFTER_MAX
+
+PAGINATED_FETCHER = '''
+def main_pages(data):
+    for page in range(100):
+        yield [f'https://example.com/{page}/{index}' for index in range(10)]
+'''
+
+SINGLE_PAGE_FETCHER = '''
+def main(data):
+    return ['https://example.com/a', 'https://example.com/b']
+'''
+
+
+class FetcherRunTests(SimpleTestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def fetcher_run(self, source, max_urls, name='urls.txt'):
+        script_path = os.path.join(self.folder.name, f'fetcher_{os.path.splitext(name)[0]}.py')
+        with open(script_path, 'w') as f:
+            f.write(source)
+        fetcher = SimpleNamespace(name='Test fetcher', path=script_path, timeout=10)
+        return FetcherRun(fetcher, os.path.join(self.folder.name, name), max_urls)
+
+    def test_pages_stop_at_max_urls(self):
+        run = self.fetcher_run(PAGINATED_FETCHER, 25)
+        self.assertEqual(run({}), 25)
+        urls = read_urls_file(run.urls_file)
+        self.assertEqual(len(urls), 25)
+        self.assertEqual(urls[0], 'https://example.com/0/0')
+        self.assertEqual(urls[-1], 'https://example.com/2/4')
+
+    def test_page_filling_max_urls(self):
+        run = self.fetcher_run(PAGINATED_FETCHER, 20)
+        self.assertEqual(run({}), 20)
+        self.assertEqual(read_urls_file(run.urls_file)[-1], 'https://example.com/1/9')
+
+    def test_single_page_fetcher(self):
+        run = self.fetcher_run(SINGLE_PAGE_FETCHER, 25)
+        self.assertEqual(run({}), 2)
+        self.assertEqual(read_urls_file(run.urls_file), ['https://example.com/a', 'https://example.com/b'])
+
+    def test_runs_dont_depend_on_each_other(self):
+        paginated = self.fetcher_run(PAGINATED_FETCHER, 15, 'paginated.txt')
+        single_page = self.fetcher_run(SINGLE_PAGE_FETCHER, 15, 'single_page.txt')
+        self.assertEqual(paginated({}), 15)
+        self.assertEqual(single_page({}), 2)
+
+    def test_budget_is_shared_when_merging(self):
+        paginated = self.fetcher_run(PAGINATED_FETCHER, 15, 'paginated.txt')
+        single_page = self.fetcher_run(SINGLE_PAGE_FETCHER, 15, 'single_page.txt')
+        paginated({})
+        single_page({})
+        merged_path = os.path.join(self.folder.name, 'merged.txt')
+        with open(merged_path, 'w') as f:
+            self.assertEqual(merge_urls([single_page, paginated], 15, f), 15)
+        urls = read_urls_file(merged_path)
+        self.assertEqual(urls[:3], ['https://example.com/a', 'https://example.com/b', 'https://example.com/0/0'])
+        self.assertEqual(urls[-1], 'https://example.com/1/2')
+
+    def test_stopped_run_writes_nothing(self):
+        run = self.fetcher_run(PAGINATED_FETCHER, 25)
+        run.stop()
+        self.assertEqual(run({}), 0)
+
+
+class CacheKeyTests(SimpleTestCase):
+    def test_equivalent_queries_share_key(self):
+        first = {'search_string': 'Floods  in Lisbon', 'keywords': ['flood', 'Lisbon'], 'start_date': datetime(2022, 1, 1), 'country_code': 'PT'}
+        second = {'country_code': 'pt', 'keywords': ['lisbon', 'flood'], 'start_date': datetime(2022, 1, 1), 'search_string': 'floods in lisbon'}
+        self.assertEqual(cache_key(first), cache_key(second))
+
+    def test_different_queries_have_different_keys(self):
+        first = {'search_string': 'floods in lisbon', 'max_urls': 100}
+        second = {'search_string': 'floods in lisbon', 'max_urls': 1000}
+        self.assertNotEqual(cache_key(first), cache_key(second))
+
+
+class CappedRetryTests(SimpleTestCase):
+    def test_retry_after_is_capped(self):
+        retry = CappedRetry(total=3)
+        self.assertEqual(retry.parse_retry_after('5'), 5)
+        self.assertEqual(retry.parse_retry_after('3600'), RETRY_AFTER_MAX)
+
+    def test_capped_after_retrying(self):
+        retry = CappedRetry(total=3).increment(method='GET', url='/')
+        self.assertIsInstance(retry, CappedRetry)
+        self.assertEqual(retry.parse_retry_after('3600'), RETRY_AFTER_MAX)
@@ -0,0 +1,74 @@
+import importlib.util
+import os
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from django.conf import settings
+from django.test import SimpleTestCase, override_settings
+from context.tasks.gather import gather_sounds
+
+
+class SoundsHandler(BaseHTTPRequestHandler):
+    routes = {
+        '/sound.mp3': (200, 'audio/mpeg', b'ID3' + b'0' * 1000),
+        '/page.html': (200, 'text/html', b'<html></html>'),
+        '/large.mp3': (200, 'audio/mpeg', b'0' * (2 * 1024 * 1024)),
+    }
+
+    def do_GET(self):
+        status, content_type, body = self.routes.get(self.path, (404, 'text/plain', b'not found'))
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.end_headers()  # no content length, so the size cap applies while streaming
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(SOUND_GATHERER_MAX_SIZE=1, SOUND_GATHERER_TIMEOUT=10, SOUND_GATHERER_WORKERS=4)
+class DefaultSoundGathererTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), SoundsHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f'http://127.0.0.1:{cls.server.server_port}'
+
+        gatherer_path = os.path.join(settings.BASE_DIR, 'gatherers', 'defaultSoundGatherer.py')
+        spec = importlib.util.spec_from_file_location('defaultSoundGatherer', gatherer_path)
+        cls.gatherer = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(cls.gatherer)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+
+    def test_outcomes(self):
+        path, reason = self.gatherer.gather(f'{self.base_url}/sound.mp3', self.folder.name)
+        self.assertIsNone(reason)
+        self.assertEqual(os.path.getsize(path), 1003)
+
+        self.assertEqual(self.gatherer.gather(f'{self.base_url}/page.html', self.folder.name), (None, 'Not a sound (text/html)'))
+        self.assertEqual(self.gatherer.gather(f'{self.base_url}/missing.mp3', self.folder.name), (None, 'HTTP status 404'))
+
+        path, reason = self.gatherer.gather(f'{self.base_url}/large.mp3', self.folder.name)
+        self.assertIsNone(path)
+        self.assertIn('Too large', reason)
+        self.assertEqual(os.listdir(self.folder.name), [os.path.basename(self.gatherer.main(f'{self.base_url}/sound.mp3', self.folder.name))])
+
+    def test_gather_sounds_logs_each_url(self):
+        urls = [f'{self.base_url}/sound.mp3', f'{self.base_url}/page.html', f'{self.base_url}/missing.mp3']
+        log_file = os.path.join(self.folder.name, 'gatherer.txt')
+
+        sound_paths = gather_sounds(self.gatherer, iter(urls), self.folder.name, log_file)
+        self.assertEqual(len(sound_paths), 1)
+        with open(log_file) as f:
+            lines = f.read().splitlines()
+        self.assertEqual([line.split(' ')[0] for line in lines], ['[OK]', '[SKIPPED]', '[SKIPPED]'])
@@ -0,0 +1,23 @@
+from types import SimpleNamespace
+from django.test import SimpleTestCase
+from context.models import ImageData, watermark_key
+from context.tasks.filter import filter_version
+
+
+class StageWatermarksTests(SimpleTestCase):
+    def test_mark_seen(self):
+        data = ImageData(data='/tmp/image.jpg')
+        first, second = SimpleNamespace(id=1), SimpleNamespace(id=2)
+        data.mark_seen('filter', first, 'v1')
+        data.mark_seen('post_process', second, 'v1')
+        data.mark_seen('filter', first, 'v2')
+        self.assertEqual(data.stage_watermarks, {watermark_key('filter', first): 'v2', watermark_key('post_process', second): 'v1'})
+
+    def test_filter_version_changes_with_the_configuration(self):
+        _filter = SimpleNamespace(path='/nonexistent/filter.py')
+        script = SimpleNamespace(VERSION='1')
+        version = filter_version(_filter, script, {'radius': 10}, False)
+        self.assertEqual(version, filter_version(_filter, script, {'radius': 10}, False))
+        self.assertNotEqual(version, filter_version(_filter, script, {'radius': 20}, False))
+        self.assertNotEqual(version, filter_version(_filter, script, {'radius': 10}, True))
+        self.assertTrue(version.startswith('1:'))
@@ -0,0 +1,79 @@
+import os
+import tempfile
+from types import SimpleNamespace
+from django.test import SimpleTestCase, override_settings
+from context import publishing
+from context.models import ImageData, SoundData
+from context.tasks.ingest import publish_files
+
+
+class PublishingTests(SimpleTestCase):
+    def setUp(self):
+        self.source_folder = tempfile.TemporaryDirectory()
+        self.dest_folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.source_folder.cleanup)
+        self.addCleanup(self.dest_folder.cleanup)
+        self.source = self.make_file('a.jpg')
+
+    def make_file(self, name, content='data'):
+        path = os.path.join(self.source_folder.name, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_copy(self):
+        dest = publishing.publish(self.source, self.dest_folder.name, publishing.COPY)
+        self.assertEqual(dest, os.path.join(self.dest_folder.name, 'a.jpg'))
+        self.assertNotEqual(os.stat(dest).st_ino, os.stat(self.source).st_ino)
+
+    def test_hardlink_uses_no_extra_space(self):
+        dest = publishing.publish(self.source, self.dest_folder.name, publishing.HARDLINK)
+        self.assertEqual(os.stat(dest).st_ino, os.stat(self.source).st_ino)
+
+    def test_symlink(self):
+        dest = publishing.publish(self.source, self.dest_folder.name, publishing.SYMLINK)
+        self.assertTrue(os.path.islink(dest))
+        self.assertEqual(os.path.realpath(dest), os.path.realpath(self.source))
+
+    def test_republish_replaces_file(self):
+        publishing.publish(self.source, self.dest_folder.name, publishing.COPY)
+        dest = publishing.publish(self.source, self.dest_folder.name, publishing.HARDLINK)
+        self.assertEqual(os.stat(dest).st_ino, os.stat(self.source).st_ino)
+
+    def test_internal_writes_nothing(self):
+        dest = publishing.publish(self.source, self.dest_folder.name, publishing.INTERNAL)
+        self.assertEqual(dest, os.path.join(self.dest_folder.name, 'a.jpg'))
+        self.assertFalse(os.path.lexists(dest))
+        publishing.unpublish(dest)
+
+    @override_settings(STATIC_ROOT='/srv/static', STATIC_URL='/static/')
+    def test_published_url(self):
+        with self.settings(STATIC_PUBLISH_STRATEGY=publishing.HARDLINK):
+            self.assertEqual(publishing.published_url('/srv/static/owner/ctx/a.jpg'), '/static/owner/ctx/a.jpg')
+        with self.settings(STATIC_PUBLISH_STRATEGY=publishing.INTERNAL):
+            self.assertEqual(publishing.published_url('/srv/static/owner/ctx/a.jpg'), '/contexts/published/owner/ctx/a.jpg')
+
+    def test_publish_files_keep_order(self):
+        sources = [self.make_file(f'{i}.jpg', str(i)) for i in range(20)]
+        context = SimpleNamespace(publish_file=lambda source: publishing.publish(source, self.dest_folder.name, publishing.COPY))
+
+        dest_paths = publish_files(context, sources)
+        self.assertEqual(dest_paths, [os.path.join(self.dest_folder.name, f'{i}.jpg') for i in range(20)])
+        with open(dest_paths[7]) as f:
+            self.assertEqual(f.read(), '7')
+
+    def test_failed_publish_is_none(self):
+        missing = os.path.join(self.source_folder.name, 'missing.jpg')
+        context = SimpleNamespace(publish_file=lambda source: publishing.publish(source, self.dest_folder.name, publishing.COPY))
+
+        self.assertEqual(publish_files(context, [missing, self.source]), [None, os.path.join(self.dest_folder.name, 'a.jpg')])
+
+
+class IdentifierTests(SimpleTestCase):
+    def test_identifier_is_the_file_name(self):
+        image = ImageData(data='/contexts/owner/code/data/full/0a1b.jpg')
+        sound = SoundData(data='/contexts/owner/code/data/9f8e.mp3')
+        image.refresh_identifier()
+        sound.refresh_identifier()
+        self.assertEqual(image.identifier, '0a1b.jpg')
+        self.assertEqual(sound.identifier, '9f8e.mp3')
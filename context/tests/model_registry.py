@@ -0,0 +1,62 @@
+import tempfile
+from types import SimpleNamespace
+from django.test import SimpleTestCase
+from context.tasks.model_registry import ModelRegistry, plugin_version
+
+
+class SizedModel:
+    def __init__(self, size):
+        self.size = size
+
+    def count_params(self):
+        return self.size // 4
+
+
+class ModelRegistryTests(SimpleTestCase):
+    def setUp(self):
+        self.loads = []
+        self.registry = ModelRegistry(memory_budget=100)
+
+    def loader(self, key, size):
+        def load():
+            self.loads.append(key)
+            return SizedModel(size)
+        return load
+
+    def test_model_loaded_once(self):
+        first = self.registry.get('a', self.loader('a', 40))
+        second = self.registry.get('a', self.loader('a', 40))
+        self.assertIs(first, second)
+        self.assertEqual(self.loads, ['a'])
+
+    def test_least_recently_used_is_evicted(self):
+        self.registry.get('a', self.loader('a', 40))
+        self.registry.get('b', self.loader('b', 40))
+        self.registry.get('a', self.loader('a', 40))  # 'b' is now the least recently used
+        self.registry.get('c', self.loader('c', 40))
+        self.assertIn('a', self.registry)
+        self.assertNotIn('b', self.registry)
+        self.assertIn('c', self.registry)
+
+    def test_model_bigger_than_budget_is_kept(self):
+        self.registry.get('a', self.loader('a', 40))
+        self.registry.get('big', self.loader('big', 400))
+        self.assertEqual(len(self.registry), 1)
+        self.assertIn('big', self.registry)
+
+
+class PluginVersionTests(SimpleTestCase):
+    def test_declared_version(self):
+        self.assertEqual(plugin_version(SimpleNamespace(path='/missing.py'), SimpleNamespace(MODEL_VERSION=2)), '2')
+
+    def test_script_hash(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.py') as f:
+            f.write('def main(path): return 1\n')
+            f.flush()
+            plugin = SimpleNamespace(path=f.name)
+            version = plugin_version(plugin, SimpleNamespace())
+            self.assertEqual(len(version), 12)
+
+            f.write('# changed\n')
+            f.flush()
+            self.assertNotEqual(plugin_version(plugin, SimpleNamespace()), version)
@@ -0,0 +1,139 @@
+import gzip
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from unittest import mock
+import requests
+from django.test import SimpleTestCase, override_settings
+from context.models import AdvancedConfiguration, Configuration, ProviderBatch
+from context.tasks.provide import result_entries, id_batches, idempotency_key, post_batch, describe_error, is_transient, retry_countdown, create_batches, deliver_batch
+from context.tests.tests_setup import ContextTestCase
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    failures_left = 0
+    received = []
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if WebhookHandler.failures_left > 0:
+            WebhookHandler.failures_left -= 1
+            self.send_response(503)
+        else:
+            WebhookHandler.received.append((dict(self.headers), gzip.decompress(body)))
+            self.send_response(200)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(PROVIDER_TIMEOUT=5)
+class WebhookBatchesTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), WebhookHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.webhook = f'http://127.0.0.1:{cls.server.server_port}/results'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        WebhookHandler.failures_left = 0
+        WebhookHandler.received = []
+
+    def test_batch_headers(self):
+        post_batch(self.webhook, gzip.compress(b'{"a": 1}\n'), {'Content-Type': 'application/x-ndjson', 'Content-Encoding': 'gzip'}, 'key', 2, 3)
+        self.assertEqual(len(WebhookHandler.received), 1)
+        headers, body = WebhookHandler.received[0]
+        self.assertEqual(body, b'{"a": 1}\n')
+        self.assertEqual(headers['Idempotency-Key'], 'key')
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        self.assertEqual(headers['X-Maestro-Batch'], '2/3')
+
+    def test_failed_batch_raises(self):
+        WebhookHandler.failures_left = 1
+        with self.assertRaises(requests.exceptions.HTTPError) as raised:
+            post_batch(self.webhook, gzip.compress(b'{}'), {'Content-Type': 'application/json'}, 'key', 1, 1)
+        self.assertEqual(WebhookHandler.received, [])
+        self.assertTrue(is_transient(raised.exception))
+        self.assertEqual(describe_error(raised.exception), 'Received a response with status code 503')
+
+
+class DeliveryRetriesTests(SimpleTestCase):
+    def http_error(self, status_code):
+        return requests.exceptions.HTTPError(response=SimpleNamespace(status_code=status_code))
+
+    def test_transient_errors(self):
+        self.assertTrue(is_transient(self.http_error(500)))
+        self.assertTrue(is_transient(self.http_error(429)))
+        self.assertTrue(is_transient(requests.exceptions.ConnectionError()))
+        self.assertTrue(is_transient(requests.exceptions.Timeout()))
+        self.assertFalse(is_transient(self.http_error(400)))
+        self.assertFalse(is_transient(self.http_error(404)))
+        self.assertFalse(is_transient(requests.exceptions.TooManyRedirects()))
+
+    @override_settings(PROVIDER_RETRY_BACKOFF=30)
+    def test_exponential_backoff(self):
+        self.assertEqual([retry_countdown(attempts) for attempts in range(1, 5)], [30, 60, 120, 240])
+
+
+class ResultEntriesTests(SimpleTestCase):
+    def test_entries(self):
+        classifiers = [SimpleNamespace(id=1, name='first'), SimpleNamespace(id=2, name='second')]
+        objects = [SimpleNamespace(id=10, identifier='a.jpg', thumb_url='host/a.jpg', metadata={'datetime': '2022'}), SimpleNamespace(id=11, identifier='b.jpg', thumb_url='host/b.jpg', metadata=None)]
+        results = {(1, 10): 'cat', (2, 11): 'dog'}
+
+        entries = list(result_entries(classifiers, objects, results, keep_null=False))
+        self.assertEqual(entries, [
+            ('first', {'name': 'a.jpg', 'preview_url': 'http://host/a.jpg', 'result': 'cat', 'datetime': '2022'}),
+            ('second', {'name': 'b.jpg', 'preview_url': 'http://host/b.jpg', 'result': 'dog', 'datetime': ''}),
+        ])
+        self.assertEqual(len(list(result_entries(classifiers, objects, results))), 4)
+
+    def test_batches_and_keys(self):
+        self.assertEqual(list(id_batches([1, 2, 3, 4, 5], 2)), [[1, 2], [3, 4], [5]])
+        context = SimpleNamespace(id=1, number_of_iterations=2)
+        self.assertEqual(idempotency_key(context, [1, 2]), idempotency_key(context, [1, 2]))
+        self.assertNotEqual(idempotency_key(context, [1, 2]), idempotency_key(context, [3, 4]))
+        self.assertNotEqual(idempotency_key(context, [1, 2]), idempotency_key(SimpleNamespace(id=1, number_of_iterations=3), [1, 2]))
+
+
+@override_settings(PROVIDER_BATCH_SIZE=2)
+class ProviderBatchesTests(ContextTestCase):
+    def setUp(self):
+        super().setUp()
+        self.advanced_configuration = AdvancedConfiguration.objects.create(webhook='http://localhost:1/results', webhook_format=AdvancedConfiguration.JSON_BATCHES)
+        self.context.configuration = Configuration.objects.create(search_string='birds', data_type=Configuration.IMAGES, advanced_configuration=self.advanced_configuration)
+        self.context.save()
+
+    def test_undelivered_batches_are_kept(self):
+        first_run = create_batches(self.context, self.advanced_configuration, [1, 2, 3, 4, 5, 6])
+        ProviderBatch.objects.filter(id=first_run[0].id).update(status=ProviderBatch.DEAD)
+        ProviderBatch.objects.filter(id=first_run[1].id).update(status=ProviderBatch.RETRYING)
+        ProviderBatch.objects.filter(id=first_run[2].id).update(status=ProviderBatch.DELIVERED)
+
+        second_run = create_batches(self.context, self.advanced_configuration, [1, 2, 3, 4, 5, 6, 7])
+        self.assertEqual([batch.object_ids for batch in second_run], [[7]])
+        self.assertEqual(ProviderBatch.objects.filter(context=self.context).count(), 4)
+
+    def test_pending_batches_are_delivered_again(self):
+        first_run = create_batches(self.context, self.advanced_configuration, [1, 2, 3])
+        second_run = create_batches(self.context, self.advanced_configuration, [1, 2, 3, 4])
+        self.assertEqual([batch.id for batch in second_run[:2]], [batch.id for batch in first_run])
+        self.assertEqual([batch.object_ids for batch in second_run[2:]], [[4]])
+
+    @override_settings(PROVIDER_BATCH_RETRIES=0)
+    def test_failure_other_than_delivery_is_recorded(self):
+        batch = create_batches(self.context, self.advanced_configuration, [1, 2])[0]
+        with mock.patch('context.tasks.provide.encode_batch', side_effect=ValueError('not serializable')):
+            delivered = deliver_batch.apply(args=(batch.id, self.context.id)).get()
+        self.assertFalse(delivered)
+        batch.refresh_from_db()
+        self.assertEqual(batch.status, ProviderBatch.DEAD)
+        self.assertEqual(batch.last_error, 'ValueError: not serializable')
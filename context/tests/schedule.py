@@ -0,0 +1,64 @@
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
+from django.test import SimpleTestCase
+from django.urls import reverse
+from django.utils import timezone
+from context.models import Configuration, SearchContext
+from context.tasks.fetch import run_fetchers
+from context.tasks.schedule import repeat_interval, running_per_owner, schedule_iterations
+from context.tests.tests_setup import ContextTestCase
+
+
+class RepeatIntervalTests(SimpleTestCase):
+    def test_interval(self):
+        self.assertEqual(repeat_interval(SimpleNamespace(repeat_amount=15, repeat_unit='MIN')), timedelta(minutes=15))
+        self.assertEqual(repeat_interval(SimpleNamespace(repeat_amount=2, repeat_unit='HOUR')), timedelta(hours=2))
+        self.assertEqual(repeat_interval(SimpleNamespace(repeat_amount=1, repeat_unit='DAY')), timedelta(days=1))
+
+    def test_not_repeated(self):
+        self.assertIsNone(repeat_interval(None))
+        self.assertIsNone(repeat_interval(SimpleNamespace(repeat_amount=None, repeat_unit=None)))
+        self.assertIsNone(repeat_interval(SimpleNamespace(repeat_amount=3, repeat_unit=None)))
+
+
+class ScheduledStartTests(ContextTestCase):
+    def setUp(self):
+        super().setUp()
+        self.context.configuration = Configuration.objects.create(search_string='birds', data_type=Configuration.IMAGES, repeat_amount=1, repeat_unit='HOUR')
+        self.context.status = SearchContext.WAITING_ITERATION
+        self.context.next_run_at = timezone.now() - timedelta(minutes=1)
+        self.context.save()
+        self.owner = (self.context.owner_type_id, self.context.owner_id)
+
+    def test_stopped_before_starting_and_resumed(self):
+        with mock.patch('context.tasks.schedule.iteration_chain') as iteration_chain:
+            self.assertEqual(schedule_iterations(), 1)
+        iteration_chain.assert_called_once_with(self.context.id)
+        self.assertEqual(running_per_owner().get(self.owner, 0), 1)
+
+        # Stopped while the iteration waits for its random delay
+        self.client.login(email=self.user_email, password=self.password)
+        self.client.get(reverse('contexts-stop', args=[self.context.code]))
+        self.assertEqual(running_per_owner().get(self.owner, 0), 0)
+        self.assertFalse(run_fetchers.apply(args=(self.context.id,)).get())
+
+        self.client.get(reverse('contexts-resume', args=[self.context.code]))
+        self.context.refresh_from_db()
+        self.assertEqual(self.context.status, SearchContext.WAITING_ITERATION)
+        self.assertFalse(self.context.is_stopped)
+        with mock.patch('context.tasks.schedule.iteration_chain') as iteration_chain:
+            self.assertEqual(schedule_iterations(), 1)
+        iteration_chain.assert_called_once_with(self.context.id)
+
+    def test_resumed_before_starting(self):
+        with mock.patch('context.tasks.schedule.iteration_chain'):
+            schedule_iterations()
+        self.client.login(email=self.user_email, password=self.password)
+        self.client.get(reverse('contexts-stop', args=[self.context.code]))
+        self.client.get(reverse('contexts-resume', args=[self.context.code]))
+
+        # The delayed iteration starts normally, so the scheduler doesn't start it again
+        with mock.patch('context.tasks.schedule.iteration_chain') as iteration_chain:
+            self.assertEqual(schedule_iterations(), 0)
+        iteration_chain.assert_not_called()
@@ -0,0 +1,68 @@
+import json
+import os
+import tempfile
+from types import SimpleNamespace
+from django.test import SimpleTestCase
+from common.templatetags.my_filters import split_log
+from context.tasks import helpers
+from context.tasks.helpers import StageLogger, buffered_log, read_log, render_log_line, write_log
+
+
+class StageLoggerTests(SimpleTestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+        self.context = SimpleNamespace(id=1, context_folder=self.folder.name)
+        self.log_file = os.path.join(self.folder.name, 'logs', 'filter.log')
+
+    def read_entries(self):
+        with open(self.log_file) as f:
+            return [json.loads(line) for line in f]
+
+    def test_json_lines(self):
+        with StageLogger(self.log_file) as logger:
+            logger.write('Started')
+            logger.write('[ERROR] Filter failed on a.jpg', obj='a.jpg', duration=0.12345)
+
+        started, failed = self.read_entries()
+        self.assertEqual((started['level'], started['message']), ('INFO', 'Started'))
+        self.assertEqual((failed['level'], failed['message'], failed['object'], failed['duration']), ('ERROR', 'Filter failed on a.jpg', 'a.jpg', 0.123))
+
+    def test_writes_are_buffered(self):
+        logger = StageLogger(self.log_file, flush_interval=3600)
+        logger.write('Started')
+        logger.write('Started again')
+        self.assertEqual(os.path.getsize(self.log_file), 0)
+        logger.write('[ERROR] Errors are flushed right away')
+        self.assertEqual(len(self.read_entries()), 3)
+        logger.close()
+
+    def test_buffered_log_keeps_the_file_open_while_the_task_runs(self):
+        opened = []
+
+        @buffered_log('filter')
+        def task(self, result, context_id):
+            write_log(self.context, 'filter', 'Will use the filters', True)
+            write_log(self.context, 'filter', 'a.jpg was filtered', obj='a.jpg')
+            opened.append(helpers._stage_loggers[(context_id, 'filter')])
+
+        write_log(self.context, 'filter', 'Previous run')
+        task(self, True, self.context.id)
+
+        self.assertIsNotNone(opened[0])
+        self.assertNotIn((self.context.id, 'filter'), helpers._stage_loggers)
+        self.assertEqual([entry['message'] for entry in self.read_entries()], ['Will use the filters', 'a.jpg was filtered'])
+
+    def test_read_log_renders_legacy_format(self):
+        os.makedirs(os.path.dirname(self.log_file))
+        with open(self.log_file, 'w') as f:
+            f.write('[01-02-2022 10:00:00] Written by an older version\n')
+        write_log(self.context, 'filter', '[ERROR] Filter failed on a.jpg', obj='a.jpg', duration=1.5)
+
+        legacy, new = read_log(self.context, 'filter')
+        self.assertEqual(legacy, '[01-02-2022 10:00:00] Written by an older version\n')
+        self.assertRegex(new, r'^\[\d\d-\d\d-\d{4} \d\d:\d\d:\d\d\] \[ERROR\] Filter failed on a.jpg \(1.5s\)\n$')
+        self.assertEqual(split_log(new)[1:], ['[ERROR]', 'Filter failed on a.jpg (1.5s)\n'])
+
+    def test_render_invalid_json_line(self):
+        self.assertEqual(render_log_line('{not json\n'), '{not json\n')
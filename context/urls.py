@@ -5,6 +5,7 @@ from . import views
 urlpatterns = [
     path('', views.SearchContextListView.as_view(), name='contexts-list'),
     path('new/', views.SearchContextCreateView.as_view(), name='contexts-new'),
+    path('published/<path:path>', views.published_file, name='contexts-published-file'),
     path('<str:code>/', views.SearchContextDetailView.as_view(), name='contexts-detail'),
     path('<str:code>/configuration/', views.SearchContextConfigurationDetailView.as_view(), name='contexts-configuration-detail'),
     path('<str:code>/configuration/update/', views.SearchContextConfigurationCreateOrUpdateView.as_view(), name='contexts-configuration-update'),
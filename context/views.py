@@ -1,12 +1,13 @@
 from __future__ import annotations
-import io
+import mimetypes
 import os
-from zipfile import ZipFile
+from urllib.parse import quote
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.messages.views import SuccessMessageMixin
 from django.core.paginator import Paginator
-from django.http import HttpResponseBadRequest, HttpResponse, HttpResponseRedirect, JsonResponse, Http404
+from django.conf import settings
+from django.http import FileResponse, HttpResponseBadRequest, HttpResponse, HttpResponseRedirect, JsonResponse, Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect
 from django.urls import reverse_lazy
 from django.views.generic import CreateView, DetailView, FormView
@@ -14,18 +15,17 @@ from django.views.generic.edit import ModelFormMixin
 from django_filters.views import FilterView
 from common.decorators import PaginatedFilterView
 from common.mixins import SafePaginationMixin
+from .export import stream_zip, stream_results, RESULTS_FORMATS, JSON
 from .authorization import UserHasAccess, UserCanEdit, user_can_edit, user_has_access
 from .filters import SearchContextFilter
 from .forms import SearchContextCreateForm, EssentialConfigurationForm, FetchingAndGatheringConfigurationForm, PostProcessingConfigurationForm, FilteringConfigurationForm, ClassificationConfigurationForm, ProvidingConfigurationForm
 from .helpers import get_user_search_contexts, compare_status, compare_status_leq
-from .models import SearchContext, Configuration, AdvancedConfiguration
+from .models import SearchContext, Configuration, AdvancedConfiguration, ImageData, SoundData
+from .publishing import unpublish
 from .tasks import delete_context_folder, create_context_folder, run_fetchers, run_default_gatherer, run_post_processors, run_filters, run_classifiers, run_provider, handle_initial_datastream
 from django.contrib import messages
 from celery import chain
-import json
-import ast
 from .tasks.helpers import read_log
-from .tasks.provide import generate_json
 
 # States that can't be stopped
 UNSTOPPABLE_STATES = [
@@ -305,7 +305,7 @@ class SearchContextDataReviewView(LoginRequiredMixin, UserHasAccess, DetailView)
         context = super().get_context_data(**kwargs)
         search_context: SearchContext = self.get_object()
         if search_context.configuration.data_type == Configuration.IMAGES or search_context.configuration.data_type == Configuration.SOUNDS:
-            objects = search_context.datastream.all()
+            objects = search_context.datastream.order_by('add_date', 'id').with_classification_results()  # paginated with the (context, add_date) index
 
             # Pagination
             paginator = Paginator(objects, 15)
@@ -354,7 +354,7 @@ def save_data_review(request, code):
                 try:
                     os.remove(original_folder_file_path)
                     os.remove(thumb_folder_file_path)
-                    os.remove(static_folder_file_path)
+                    unpublish(static_folder_file_path)
                     db_object.delete()
                 except Exception as ex:
                     print(ex)
@@ -372,7 +372,7 @@ def save_data_review(request, code):
                 db_object = db_object[0]
                 try:
                     os.remove(original_folder_file_path)
-                    os.remove(static_folder_file_path)
+                    unpublish(static_folder_file_path)
                     db_object.delete()
                 except Exception as ex:
                     print(ex)
@@ -413,6 +413,33 @@ class PipelineProcessDetail(LoginRequiredMixin, UserHasAccess, DetailView):
         return context
 
 
+def published_file(request, path):
+    """Serves the files published with the 'internal' strategy (see context/publishing.py). Public, like the static files"""
+    published_path = os.path.normpath(os.path.join(settings.STATIC_ROOT, path))
+    parts = os.path.relpath(published_path, settings.STATIC_ROOT).split(os.sep)
+    if len(parts) < 3 or parts[0] == '..':
+        raise Http404
+
+    context_code = parts[-2]
+    source = ImageData.objects.filter(context__code=context_code, data_thumb_static=published_path).values_list('data_thumb', flat=True).first()
+    if source is None:
+        source = SoundData.objects.filter(context__code=context_code, data_static=published_path).values_list('data', flat=True).first()
+    if source is None or not os.path.isfile(source):
+        raise Http404
+
+    content_type, _ = mimetypes.guess_type(source)
+    header = settings.STATIC_PUBLISH_SENDFILE_HEADER
+    if header == 'X-Accel-Redirect':
+        response = HttpResponse(content_type=content_type)
+        response[header] = quote(settings.STATIC_PUBLISH_INTERNAL_URL + os.path.relpath(source, settings.CONTEXTS_DATA_DIR))
+    elif header == 'X-Sendfile':
+        response = HttpResponse(content_type=content_type)
+        response[header] = source
+    else:
+        response = FileResponse(open(source, 'rb'), content_type=content_type)
+    return response
+
+
 @login_required
 @user_has_access
 def download_results(request, code):
@@ -424,14 +451,17 @@ def download_results(request, code):
     if not context.configuration.advanced_configuration or not context.configuration.advanced_configuration.classifiers:
         return HttpResponseBadRequest()
 
-    classifiers = context.configuration.advanced_configuration.classifiers.filter(is_active=True)
+    results_format = request.GET.get('format', JSON)
+    if results_format not in RESULTS_FORMATS:
+        return HttpResponseBadRequest()
 
-    json_data = generate_json(classifiers, context.datastream, context.configuration.advanced_configuration.keep_null)
-    json_obj = json.dumps(json_data, indent=4)
+    classifiers = context.configuration.advanced_configuration.classifiers.filter(is_active=True)
+    datastream = context.datastream.unfiltered()  # like the results sent to the webhook
+    content_type, file_name = RESULTS_FORMATS[results_format]
 
-    return HttpResponse(json_obj, headers={
-        'Content-Type': 'application/json',
-        'Content-Disposition': 'attachment; filename="results.json"'
+    return StreamingHttpResponse(stream_results(classifiers, datastream, results_format, context.configuration.advanced_configuration.keep_null), headers={
+        'Content-Type': content_type,
+        'Content-Disposition': f'attachment; filename="{file_name}"'
     })
 
 
@@ -446,15 +476,10 @@ def download_files(request, code):
     if not context.configuration.advanced_configuration or not context.configuration.advanced_configuration.classifiers:
         return HttpResponseBadRequest()
 
-    filtered_datastream = context.datastream.filter(filtered=False)
-    files = [obj.data for obj in filtered_datastream]
-
-    zip_buffer = io.BytesIO()
-    with ZipFile(zip_buffer, 'w') as zip_file:
-        for file in files:
-            zip_file.write(filename=file, arcname=os.path.basename(file))
+    # The archive is written while it is sent, so memory doesn't grow with the context
+    files = context.datastream.unfiltered().values_list('data', flat=True).iterator()
 
-    return HttpResponse(zip_buffer.getvalue(), headers={
+    return StreamingHttpResponse(stream_zip(files), headers={
         'Content-Type': 'application/zip',
         'Content-Disposition': 'attachment; filename=files.zip'
     })
@@ -475,13 +500,7 @@ def rerun_from_stage(request, code):
     if stage == 'fetch':
         chain(run_fetchers.s(context.id), run_default_gatherer.s(context.id), run_post_processors.s(context.id), run_filters.s(context.id), run_classifiers.s(context.id), run_provider.s(context.id)).apply_async()
     elif stage == 'gather':
-        try:
-            with open(f'{context.context_folder}/urls.txt', 'r') as f:
-                urls_list_str = f.read()
-            urls_list = ast.literal_eval(urls_list_str)
-            chain(run_default_gatherer.s(urls_list, context.id), run_post_processors.s(context.id), run_filters.s(context.id), run_classifiers.s(context.id), run_provider.s(context.id)).apply_async()
-        except:
-            chain(run_default_gatherer.s([], context.id), run_post_processors.s(context.id), run_filters.s(context.id), run_classifiers.s(context.id), run_provider.s(context.id)).apply_async()
+        chain(run_default_gatherer.s(True, context.id), run_post_processors.s(context.id), run_filters.s(context.id), run_classifiers.s(context.id), run_provider.s(context.id)).apply_async()
     elif stage == 'post-process':
         chain(run_post_processors.s(True, context.id), run_filters.s(context.id), run_classifiers.s(context.id), run_provider.s(context.id)).apply_async()
     elif stage == 'filter':
@@ -489,6 +508,8 @@ def rerun_from_stage(request, code):
     elif stage == 'classify':
         chain(run_classifiers.s(True, context.id), run_provider.s(context.id)).apply_async()
     elif stage == 'provide':
+        # Sends every result again, not only the new ones
+        context.datastream.update(provided_at=None)
         run_provider.delay(True, context.id)
     else:
         return HttpResponseBadRequest()
@@ -508,12 +529,11 @@ class SearchContextDataObjectReviewView(LoginRequiredMixin, UserHasAccess, Detai
     def setup(self, request, *args, **kwargs):
         super().setup(request, *args, **kwargs)
         self.context = get_object_or_404(SearchContext, code=self.kwargs.get('code', None))
-        self.obj = [el for el in self.context.datastream.all() if el.identifier == self.kwargs.get('objectId', None)]
-        if not self.obj or len(self.obj) == 0 or self.context.number_of_iterations == 0:
+        datastream = self.context.datastream
+        self.obj = datastream.filter(identifier=self.kwargs.get('objectId', None)).first() if datastream is not None else None
+        if self.obj is None or self.context.number_of_iterations == 0:
             raise Http404
 
-        self.obj = self.obj[0]
-
         allowed_status = compare_status(self.context.status, SearchContext.FINISHED_PROVIDING)
         if not allowed_status:
             raise Http404
@@ -554,13 +574,7 @@ def resume_execution(request, code):
     if SearchContext.FETCHING_URLS in status:
         chain(run_fetchers.s(context.id), run_default_gatherer.s(context.id), run_post_processors.s(context.id), run_filters.s(context.id), run_classifiers.s(context.id), run_provider.s(context.id)).apply_async()
     elif SearchContext.GATHERING_DATA in status:
-        try:
-            with open(f'{context.context_folder}/urls.txt', 'r') as f:
-                urls_list_str = f.read()
-            urls_list = ast.literal_eval(urls_list_str)
-            chain(run_default_gatherer.s(urls_list, context.id), run_post_processors.s(context.id), run_filters.s(context.id), run_classifiers.s(context.id), run_provider.s(context.id)).apply_async()
-        except:
-            chain(run_default_gatherer.s([], context.id), run_post_processors.s(context.id), run_filters.s(context.id), run_classifiers.s(context.id), run_provider.s(context.id)).apply_async()
+        chain(run_default_gatherer.s(True, context.id), run_post_processors.s(context.id), run_filters.s(context.id), run_classifiers.s(context.id), run_provider.s(context.id)).apply_async()
     elif SearchContext.POST_PROCESSING in status:
         chain(run_post_processors.s(True, context.id), run_filters.s(context.id), run_classifiers.s(context.id), run_provider.s(context.id)).apply_async()
     elif SearchContext.FILTERING in status:
@@ -0,0 +1,25 @@
+def country_code_to_language(country_code):
+    if country_code == 'US':
+        return 'en-US, en'
+    elif country_code == 'PT':
+        return 'pt-PT, pt'
+
+
+def build_accept_language(country_code: str, get_english_results: bool = True) -> str:
+    """Accept language header is built based on the country code.
+    mkt header is prefered by Bing, however it doesn't support the Portuguese market, thus we use the cc (country code)+Accept-Language option.
+    This function is made simple because only Portuguese (Portugal) and US (USA) country codes are supported at the time.
+
+    Parameters
+    ----------
+    country_code : str
+    get_english_results: bool
+        Besides the country_code correspondent headers, add the 'en' to include english results
+    """
+
+    language = country_code_to_language(country_code)
+
+    if not country_code == 'US' and get_english_results:
+        language += ', en'
+
+    return language
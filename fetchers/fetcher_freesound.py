@@ -1,9 +1,10 @@
 import requests
 from django.conf import settings
 from operator import itemgetter
+from fetchers import runtime
 
 
-def main(data: dict):
+def main_pages(data: dict):
     search_string, keywords, country_code = itemgetter('search_string', 'keywords', 'country_code')(data)
 
     api_key = settings.FREESOUND_KEY
@@ -13,18 +14,32 @@ def main(data: dict):
         'query': search_string,
         'tags': ','.join(keywords),
         'fields': 'name,previews',
-        'token': api_key
+        'token': api_key,
+        'page_size': 150,  # maximum allowed per page
+        'page': 1
     }
 
-    # Call the API
-    try:
-        response = requests.get(endpoint, params=params)
-        response.raise_for_status()
-        response_json = response.json()
+    while True:
+        # Call the API
+        try:
+            response = runtime.get(endpoint, params=params)
+            response.raise_for_status()
+            response_json = response.json()
+        except requests.exceptions.RequestException as ex:
+            if ex.response is not None:
+                print(ex.response.text)
+            raise ex
 
         links = [value['previews']['preview-hq-mp3'] for value in response_json['results']]
+        if len(links) == 0:
+            return
+        yield links
+
+        # Follow the page cursor until there are no more results
+        if response_json.get('next') is None:
+            return
+        params['page'] += 1
 
-        return links
-    except requests.exceptions.RequestException as ex:
-        print(ex.response.json())
-        raise ex
+
+def main(data: dict):
+    return next(main_pages(data), [])
@@ -1,6 +1,7 @@
 import requests
 from django.conf import settings
 from operator import itemgetter
+from fetchers import runtime
 
 
 def build_query(search_string, keywords):
@@ -8,7 +9,7 @@ def build_query(search_string, keywords):
     return f'({search_string} has:images) OR ({keywords_hashtags} has:images has:hashtags)'
 
 
-def main(data: dict):
+def main_pages(data: dict):
     dtformat = '%Y-%m-%dT%H:%M:%SZ'
     search_string, keywords, country_code = itemgetter('search_string', 'keywords', 'country_code')(data)
 
@@ -22,7 +23,7 @@ def main(data: dict):
         'media.fields': 'preview_image_url,url',
         'place.fields': 'country,country_code,geo',
         'tweet.fields': 'created_at,lang,text',
-        'max_results': 25
+        'max_results': 100  # maximum allowed per page
     }
 
     if 'start_date' in data and data['start_date'] is not None:
@@ -35,15 +36,27 @@ def main(data: dict):
         'Authorization': f'Bearer {api_key}',
     }
 
-    # Call the API
-    try:
-        response = requests.get(endpoint, headers=headers, params=params)
-        response.raise_for_status()
-        response_json = response.json()
+    while True:
+        # Call the API
+        try:
+            response = runtime.get(endpoint, headers=headers, params=params)
+            response.raise_for_status()
+            response_json = response.json()
+        except requests.exceptions.RequestException as ex:
+            if ex.response is not None:
+                print(ex.response.text)
+            raise ex
+
+        # Not every tweet has images with a url (e.g.: videos only have a preview)
+        media = response_json.get('includes', {}).get('media', [])
+        yield [value['url'] for value in media if 'url' in value]
 
-        links = [value['url'] for value in response_json['includes']['media']]
+        # Follow the next_token cursor until there are no more results
+        next_token = response_json.get('meta', {}).get('next_token', None)
+        if next_token is None:
+            return
+        params['next_token'] = next_token
 
-        return links
-    except requests.exceptions.RequestException as ex:
-        print(ex.response.json())
-        raise ex
+
+def main(data: dict):
+    return next(main_pages(data), [])
@@ -0,0 +1,57 @@
+"""
+Shared HTTP runtime for fetchers (and other plugins that call external APIs).
+All requests go through the same session, so connections to each host are kept alive and reused. Requests have a default timeout, and failed
+requests are retried with exponential backoff when the server is overloaded (429 and 5xx), honouring its Retry-After header (up to RETRY_AFTER_MAX).
+"""
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DEFAULT_TIMEOUT = (5, 30)  # (connect, read) in seconds
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+MAX_RETRIES = 3
+BACKOFF_FACTOR = 1  # waits 0s, 2s, 4s, ... between retries (urllib3 doesn't wait before the first retry)
+RETRY_AFTER_MAX = 30  # maximum seconds waited for a Retry-After header, so a fetcher isn't kept asleep after its timeout
+POOL_SIZE = 10  # connections kept alive per host
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class CappedRetry(Retry):
+    """Retry that waits at most RETRY_AFTER_MAX seconds when the server sends a Retry-After header"""
+
+    def parse_retry_after(self, retry_after):
+        return min(super().parse_retry_after(retry_after), RETRY_AFTER_MAX)
+
+
+def build_session():
+    retry = CappedRetry(
+        total=MAX_RETRIES,
+        backoff_factor=BACKOFF_FACTOR,
+        status_forcelist=RETRY_STATUS_CODES,
+        allowed_methods=frozenset(['GET', 'HEAD']),
+        respect_retry_after_header=True,
+        raise_on_status=False  # the last response is returned, so that raise_for_status() reports it
+    )
+    adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_session():
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = build_session()
+    return _session
+
+
+def get(url, **kwargs):
+    """Same as requests.get, but using the shared session and a default timeout"""
+    kwargs.setdefault('timeout', DEFAULT_TIMEOUT)
+    return get_session().get(url, **kwargs)
@@ -1,24 +1,75 @@
 import os
-import requests
+import time
 from hashlib import md5
+from django.conf import settings
+from fetchers import runtime
 
+CHUNK_SIZE = 64 * 1024
+EXTENSIONS = {
+    'audio/mpeg': 'mp3',
+    'audio/mp3': 'mp3',
+    'audio/ogg': 'ogg',
+    'application/ogg': 'ogg',
+    'audio/wav': 'wav',
+    'audio/x-wav': 'wav',
+    'audio/wave': 'wav',
+    'audio/flac': 'flac',
+    'audio/x-flac': 'flac',
+}
+
+
+class SkippedURL(Exception):
+    pass
 
-def main(url, dest_path):
-    file_name = md5(url.encode('utf-8')).hexdigest()
-    response = requests.get(url)
 
-    if response.status_code != 200 or response.content == b'':
-        return None
+def download(url, dest_path, max_bytes, timeout):
+    """Streams the sound in url into dest_path, in chunks. Returns the file path, or raises SkippedURL with the reason"""
+    deadline = time.monotonic() + timeout
+    with runtime.get(url, stream=True) as response:
+        if response.status_code != 200:
+            raise SkippedURL(f'HTTP status {response.status_code}')
 
-    content_type = response.headers['content-type']
-    extension = 'mp3'
-    if content_type == 'audio/mpeg':
-        extension = 'mp3'
-    else:
-        pass
+        # Checked before downloading the body
+        content_type = response.headers.get('content-type', '').split(';')[0].strip().lower()
+        if not content_type.startswith('audio/') and content_type not in EXTENSIONS:
+            raise SkippedURL(f'Not a sound ({content_type or "no content type"})')
+        content_length = response.headers.get('content-length')
+        if content_length is not None and content_length.isdigit() and int(content_length) > max_bytes:
+            raise SkippedURL(f'Too large ({content_length} bytes)')
 
-    file_path = f'{os.path.join(dest_path, file_name)}.{extension}'
-    with open(file_path, 'wb') as f:
-        f.write(response.content)
+        file_name = md5(url.encode('utf-8')).hexdigest()
+        file_path = f'{os.path.join(dest_path, file_name)}.{EXTENSIONS.get(content_type, "mp3")}'
+        part_path = f'{file_path}.part'
+        size = 0
+        try:
+            with open(part_path, 'wb') as f:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > max_bytes:
+                        raise SkippedURL(f'Too large (more than {max_bytes} bytes)')
+                    if time.monotonic() > deadline:
+                        raise SkippedURL(f'Timed out after {timeout} seconds')
+                    f.write(chunk)
+            if size == 0:
+                raise SkippedURL('Empty response')
+            os.replace(part_path, file_path)
+        finally:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+
+    return file_path
 
+
+def gather(url, dest_path):
+    """Returns a (file_path, None) pair if the sound was downloaded, or (None, reason) otherwise"""
+    try:
+        return download(url, dest_path, settings.SOUND_GATHERER_MAX_SIZE * 1024 * 1024, settings.SOUND_GATHERER_TIMEOUT), None
+    except SkippedURL as ex:
+        return None, str(ex)
+    except Exception as ex:
+        return None, f'{type(ex).__name__}: {ex}'
+
+
+def main(url, dest_path):
+    file_path, _ = gather(url, dest_path)
     return file_path
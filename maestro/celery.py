@@ -16,8 +16,5 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 # Load task modules from all registered Django apps.
 app.autodiscover_tasks(['context'])
 
-# Necessary for scrapy not to throw "Reactor not restartable" exception
-app.conf.update(
-    worker_max_tasks_per_child=1,
-    broker_pool_limit=None
-)
+# Worker processes are reused between tasks: scrapy crawls run on a long-lived reactor (see context/tasks/crawler.py)
+# Queues and routes of the tasks are set in settings.CELERY_TASK_ROUTES
@@ -194,6 +194,37 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'Europe/London'
 CELERY_RESULT_BACKEND = 'django-db'
 
+# Each queue is consumed by its own worker (see deploy/ansible-playbooks/templates/celery.service.j2), so a long stage doesn't delay the tasks of
+# other stages or the interactive ones. The control queue is for fast tasks (e.g.: creating the context folder) and celery internal tasks
+CELERY_TASK_DEFAULT_QUEUE = 'control'
+CELERY_TASK_ROUTES = {
+    'context.tasks.create_context_folder.*': {'queue': 'control'},
+    'context.tasks.schedule.*': {'queue': 'control'},
+    'context.tasks.delete_context_folder.*': {'queue': 'housekeeping'},
+    'context.tasks.handle_initial_datastream.*': {'queue': 'housekeeping'},
+    'context.tasks.fetch.*': {'queue': 'fetch'},
+    'context.tasks.gather.*': {'queue': 'gather'},
+    'context.tasks.post_process.*': {'queue': 'process'},
+    'context.tasks.filter.*': {'queue': 'process'},
+    'context.tasks.classify.*': {'queue': 'classify'},
+    'context.tasks.provide.*': {'queue': 'provide'},
+}
+# Stage tasks are long, so workers reserve one task at a time (the control worker overrides it with --prefetch-multiplier)
+CELERY_WORKER_PREFETCH_MULTIPLIER = int(os.getenv('CELERY_WORKER_PREFETCH_MULTIPLIER', 1))
+
+# Scheduler of the iterations of repeated contexts (see context/tasks/schedule.py). Runs every SCHEDULER_TICK seconds with celery beat,
+# starting up to SCHEDULER_BATCH_SIZE due contexts, delayed by up to SCHEDULER_JITTER seconds. Owners run up to SCHEDULER_MAX_RUNNING_PER_OWNER contexts at once
+SCHEDULER_TICK = int(os.getenv('SCHEDULER_TICK', 30))
+SCHEDULER_BATCH_SIZE = int(os.getenv('SCHEDULER_BATCH_SIZE', 100))
+SCHEDULER_JITTER = int(os.getenv('SCHEDULER_JITTER', 30))
+SCHEDULER_MAX_RUNNING_PER_OWNER = int(os.getenv('SCHEDULER_MAX_RUNNING_PER_OWNER', 2))
+CELERY_BEAT_SCHEDULE = {
+    'schedule-iterations': {
+        'task': 'context.tasks.schedule.schedule_iterations',
+        'schedule': SCHEDULER_TICK,
+    },
+}
+
 # SerpAPI key
 SERPAPI_KEY = os.getenv('SERPAPI_KEY', '')
 
@@ -214,6 +245,67 @@ ARCGIS_KEY = os.getenv('ARCGIS_KEY', '')
 
 FREESOUND_KEY = os.getenv('FREESOUND_KEY', '')
 
+# Maximum number of URLs fetched per context iteration, when the context doesn't specify one
+FETCHER_URL_BUDGET = int(os.getenv('FETCHER_URL_BUDGET', 1000))
+
+# Maximum time (in seconds) the stage logs are kept in memory before being written to disk
+STAGE_LOG_FLUSH_INTERVAL = float(os.getenv('STAGE_LOG_FLUSH_INTERVAL', 2))
+
+# Maximum time (in seconds) a gathering crawl may take before it is stopped
+GATHERER_CRAWL_TIMEOUT = int(os.getenv('GATHERER_CRAWL_TIMEOUT', 3600))
+
+# Concurrent downloads, maximum size (in MB) and maximum download time (in seconds) of each sound in the default sound gatherer
+SOUND_GATHERER_WORKERS = int(os.getenv('SOUND_GATHERER_WORKERS', 8))
+SOUND_GATHERER_MAX_SIZE = int(os.getenv('SOUND_GATHERER_MAX_SIZE', 50))
+SOUND_GATHERER_TIMEOUT = int(os.getenv('SOUND_GATHERER_TIMEOUT', 120))
+
+# How context files (thumbnails and sounds) are published to the static folder: copy, hardlink, symlink or internal (see context/publishing.py)
+STATIC_PUBLISH_STRATEGY = os.getenv('STATIC_PUBLISH_STRATEGY', 'hardlink')
+# With the internal strategy, files are served by the web server if a header is set: X-Accel-Redirect (nginx) or X-Sendfile (Apache)
+STATIC_PUBLISH_SENDFILE_HEADER = os.getenv('STATIC_PUBLISH_SENDFILE_HEADER', '')
+# nginx internal location aliasing CONTEXTS_DATA_DIR (used with X-Accel-Redirect)
+STATIC_PUBLISH_INTERNAL_URL = os.getenv('STATIC_PUBLISH_INTERNAL_URL', '/protected/')
+
+# Number of threads publishing gathered files, and number of data objects created per query
+INGESTION_WORKERS = int(os.getenv('INGESTION_WORKERS', 8))
+INGESTION_BATCH_SIZE = int(os.getenv('INGESTION_BATCH_SIZE', 1000))
+
+# Maximum number of URLs kept in the fetchers cache (shared by all contexts)
+FETCH_CACHE_MAX_URLS = int(os.getenv('FETCH_CACHE_MAX_URLS', 1000000))
+
+# Number of data objects whose results (post-processing, filtering, classification) are saved at once
+RESULTS_COMMIT_INTERVAL = int(os.getenv('RESULTS_COMMIT_INTERVAL', 500))
+
+# Webhook requests: timeout (in seconds), number of data objects per batch and retries of each failed batch (see context/tasks/provide.py)
+# Retries wait PROVIDER_RETRY_BACKOFF seconds, doubled on each attempt. Batches failing every retry are kept as dead letters
+PROVIDER_TIMEOUT = int(os.getenv('PROVIDER_TIMEOUT', 30))
+PROVIDER_BATCH_SIZE = int(os.getenv('PROVIDER_BATCH_SIZE', 500))
+PROVIDER_BATCH_RETRIES = int(os.getenv('PROVIDER_BATCH_RETRIES', 5))
+PROVIDER_RETRY_BACKOFF = int(os.getenv('PROVIDER_RETRY_BACKOFF', 30))
+
+# Number of data objects loaded at once by the results downloads
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', 1000))
+
+# Number of processes running the post-processors, filters and classifiers of a stage (1 runs them in the task process),
+# and number of data objects sent to a process at once. Each process is started by each worker process, and each classifier process loads its own model
+STAGE_PROCESSES = {
+    'post_process': int(os.getenv('POST_PROCESS_PROCESSES', 1)),
+    'filter': int(os.getenv('FILTER_PROCESSES', 1)),
+    'classify': int(os.getenv('CLASSIFY_PROCESSES', 1)),
+}
+STAGE_CHUNK_SIZE = int(os.getenv('STAGE_CHUNK_SIZE', 32))
+
+# Number of data objects in each task of the post-processing, filtering and classification stages. Larger stages are split in tasks that run in parallel on the workers (0 to disable)
+STAGE_FANOUT_CHUNK_SIZE = int(os.getenv('STAGE_FANOUT_CHUNK_SIZE', 2000))
+# Number of URLs in each task of the gathering stage (0 to disable)
+GATHER_FANOUT_CHUNK_SIZE = int(os.getenv('GATHER_FANOUT_CHUNK_SIZE', 5000))
+
+# Memory budget (in MB) for the classifier models kept loaded in each worker. Least recently used models are evicted when exceeded
+CLASSIFIER_MODELS_MEMORY_BUDGET = int(os.getenv('CLASSIFIER_MODELS_MEMORY_BUDGET', 2048))
+
+# Number of data objects sent at once to classifiers that support batches
+CLASSIFIER_BATCH_SIZE = int(os.getenv('CLASSIFIER_BATCH_SIZE', 16))
+
 if DEBUG:
     STATICFILES_FINDERS = [
         # Default